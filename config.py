@@ -6,3 +6,29 @@ CODE = Path(__file__).parent.resolve() / "developer"
 OUT = Path(__file__).parent.resolve() / "out"
 
 MOCK_DATA = IN / "mock_data"
+
+# Storage format of the intermediate tables: "csv", "parquet" or "feather". Parquet and
+# Feather keep dtypes and indexes. The streaming and incremental modes of the data
+# management write CSV or Parquet only.
+TABLE_FORMAT = "csv"
+
+# Number of processes for the subgroup estimations. None uses all cores.
+N_WORKERS = None
+
+# Respondent cluster bootstrap of the AMCE and marginal means
+BOOTSTRAP_REPLICATES = 2000
+BOOTSTRAP_SEED = 20231123
+
+# Permutation tests of the subgroup differences
+PERMUTATIONS = 5000
+PERMUTATION_SEED = 20231124
+
+# Disk cache of model estimates and marginal means, reused while their inputs are
+# unchanged. Least recently used entries are evicted above the size limit.
+RESULT_CACHE = OUT / "cache" / "results"
+RESULT_CACHE_MAX_BYTES = 200 * 2**20
+
+# Latent-class segmentation of the respondents
+LATENT_CLASSES = 2
+LATENT_RESTARTS = 20
+LATENT_SEED = 20231125
@@ -0,0 +1,168 @@
+"""Respondent cluster bootstrap of the AMCE and marginal means."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis.design import design_matrix
+from analysis.estimation import cluster_indicator
+from analysis.model import respondent_sums
+from analysis.registry import explanatory_variables
+
+# Statistics of the worker processes, set once per worker
+_statistics = None
+
+
+def cluster_weights(n_clusters, n_replicates, rng):
+    """Draw bootstrap weights for resampling clusters with replacement.
+
+    Args:
+        n_clusters (int): Number of clusters.
+        n_replicates (int): Number of bootstrap replicates.
+        rng (numpy.random.Generator): Random number generator.
+
+    Returns:
+        numpy.ndarray: (n_replicates x n_clusters) matrix of how often every cluster is
+            drawn in every replicate.
+
+    """
+    return rng.multinomial(n_clusters, np.full(n_clusters, 1 / n_clusters), size=n_replicates)
+
+
+def ols_cluster_statistics(data, explanatory_vars, outcome="support", groups="ID", chunk_size=2_000):
+    """Per-cluster cross products of a linear probability model.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        explanatory_vars (list): Explanatory variables. A constant is added.
+        outcome (str): Name of the outcome.
+        groups (str): Name of the cluster variable.
+        chunk_size (int): Number of rows processed at once.
+
+    Returns:
+        tuple: X'X (n_clusters x p x p) and X'y (n_clusters x p) of every cluster.
+
+    """
+    X = design_matrix(data, explanatory_vars).matrix.astype(np.float64)
+    y = data[outcome].to_numpy(dtype=np.float64)
+    H = cluster_indicator(data[groups]).tocsc()
+    n, p = X.shape
+
+    gram = np.zeros((H.shape[0], p * p))
+    for start in range(0, n, chunk_size):
+        rows = slice(start, start + chunk_size)
+        outer = (X[rows, :, None] * X[rows, None, :]).reshape(-1, p * p)
+        gram += H[:, rows] @ outer
+    return gram.reshape(-1, p, p), H @ (X * y[:, None])
+
+
+def _init_worker(statistics):
+    global _statistics
+    _statistics = statistics
+
+
+def _ols_replicates(seed, n_replicates):
+    gram, xy = _statistics
+    W = cluster_weights(len(xy), n_replicates, np.random.default_rng(seed)).astype(np.float64)
+    p = xy.shape[1]
+    bread = np.linalg.pinv((W @ gram.reshape(-1, p * p)).reshape(-1, p, p), rcond=1e-10, hermitian=True)
+    return np.einsum("bij,bj->bi", bread, W @ xy)
+
+
+def _mm_replicates(seed, n_replicates):
+    level_rows, level_support = _statistics
+    W = cluster_weights(len(level_rows), n_replicates, np.random.default_rng(seed)).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (W @ level_support) / (W @ level_rows)
+
+
+def _run_replicates(function, statistics, n_replicates, seed, chunk_size, max_workers):
+    """Run the replicates in chunks with independent seeds spawned from ``seed``.
+
+    The chunks and their seeds do not depend on the number of workers, so results are
+    reproducible on any machine.
+    """
+    sizes = [min(chunk_size, n_replicates - start) for start in range(0, n_replicates, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if max_workers == 1:
+        _init_worker(statistics)
+        return np.concatenate([function(s, size) for s, size in zip(seeds, sizes)])
+
+    max_workers = min(max_workers or os.cpu_count(), len(sizes))
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(statistics,)) as pool:
+        return np.concatenate(list(pool.map(function, seeds, sizes)))
+
+
+def bootstrap_amce(data, registry, model="model3c", n_replicates=1000, seed=0, chunk_size=100, max_workers=None):
+    """Respondent cluster bootstrap of a linear probability model.
+
+    Every replicate resamples respondents with replacement. Replicates are computed as
+    weighted regressions from the per-respondent cross products: a chunk of replicates is
+    one matrix of multinomial respondent weights, and its X'X and X'y are matrix products
+    of that matrix with the per-respondent cross products.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        registry (dict): The model registry.
+        model (str): Name of the model in the registry.
+        n_replicates (int): Number of replicates.
+        seed (int): Seed of the random number generator.
+        chunk_size (int): Number of replicates per job.
+        max_workers (int, optional): Number of processes. Defaults to the number of
+            cores. With 1, the replicates run in the current process.
+
+    Returns:
+        pandas.DataFrame: The coefficients of every replicate.
+
+    """
+    explanatory_vars = explanatory_variables(data.columns, model, registry)
+    statistics = ols_cluster_statistics(data, explanatory_vars)
+    replicates = _run_replicates(_ols_replicates, statistics, n_replicates, seed, chunk_size, max_workers)
+    return pd.DataFrame(replicates, columns=["const"] + explanatory_vars)
+
+
+def bootstrap_marginal_means(data, n_replicates=1000, seed=0, chunk_size=100, max_workers=None):
+    """Respondent cluster bootstrap of the marginal means of all attribute levels.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        n_replicates (int): Number of replicates.
+        seed (int): Seed of the random number generator.
+        chunk_size (int): Number of replicates per job.
+        max_workers (int, optional): Number of processes. Defaults to the number of
+            cores. With 1, the replicates run in the current process.
+
+    Returns:
+        pandas.DataFrame: The marginal means of every replicate, with the columns of
+            ``marginal_means``.
+
+    """
+    attributes_levels = data.columns[data.columns.str.startswith("att")]
+    _, _, level_rows, level_support = respondent_sums(data, attributes_levels)
+    statistics = (level_rows, level_support)
+    replicates = _run_replicates(_mm_replicates, statistics, n_replicates, seed, chunk_size, max_workers)
+    return pd.DataFrame(replicates, columns=[f"{att_level}_MM" for att_level in attributes_levels])
+
+
+def bootstrap_intervals(replicates, level=0.95):
+    """Percentile intervals and standard errors from bootstrap replicates.
+
+    Args:
+        replicates (pandas.DataFrame): Replicates as returned by ``bootstrap_amce`` or
+            ``bootstrap_marginal_means``.
+        level (float): Confidence level.
+
+    Returns:
+        pandas.DataFrame: Standard error and lower and upper bound of every estimate.
+
+    """
+    alpha = (1 - level) / 2
+    return pd.DataFrame(
+        {
+            "se": replicates.std(),
+            "lower": replicates.quantile(alpha),
+            "upper": replicates.quantile(1 - alpha),
+        }
+    )
@@ -0,0 +1,95 @@
+"""Content-addressed disk cache of model estimates and marginal means tables."""
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analysis.estimation import Estimates, load_estimates
+from utilities import read_table, write_table
+
+SUFFIXES = {Estimates: ".npz", pd.DataFrame: ".parquet"}
+
+
+def subgroup_hash(data, columns, conditions=None):
+    """Hash of the values of some columns on the rows of a subgroup.
+
+    Args:
+        data (pandas.DataFrame): The data.
+        columns (list): Columns used by an estimator.
+        conditions (dict, optional): Subgroup definition as variable-value pairs.
+
+    Returns:
+        str: Hex digest, which changes whenever a value, a dtype or the order of the
+            selected rows and columns changes.
+
+    """
+    columns = list(dict.fromkeys(list(columns) + list(conditions or {})))
+    mask = np.ones(len(data), dtype=bool)
+    for variable, value in (conditions or {}).items():
+        mask &= data[variable].to_numpy() == value
+
+    subset = data.loc[mask, columns]
+    digest = hashlib.sha256(repr([(c, str(subset[c].dtype)) for c in columns]).encode())
+    digest.update(pd.util.hash_pandas_object(subset, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def result_key(*parts):
+    """Cache key of a result, from everything its value depends on.
+
+    Args:
+        *parts: Objects with a deterministic ``repr``, e.g. the estimator version, the
+            model specification, the subgroup definition and the ``subgroup_hash`` of
+            the data.
+
+    Returns:
+        str: The key.
+
+    """
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class ResultCache:
+    """Size-bounded disk cache of estimates and tables, keyed by ``result_key``.
+
+    Every entry is one file. Reading an entry marks it as recently used; when the cache
+    outgrows ``max_bytes``, the least recently used entries are deleted.
+
+    Args:
+        directory (str or pathlib.Path): Directory holding the entries.
+        max_bytes (int): Maximum total size of the entries.
+
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key):
+        """Return the cached value of key, or None."""
+        for suffix in SUFFIXES.values():
+            path = self.directory / f"{key}{suffix}"
+            if path.exists():
+                os.utime(path)
+                return load_estimates(path) if suffix == ".npz" else read_table(path)
+        return None
+
+    def put(self, key, value):
+        """Store value (``Estimates`` or a DataFrame) under key."""
+        path = self.directory / f"{key}{SUFFIXES[type(value)]}"
+        if isinstance(value, Estimates):
+            value.save(path)
+        else:
+            write_table(value, path)
+        self._evict()
+
+    def _evict(self):
+        entries = sorted((p for p in self.directory.iterdir() if p.suffix in SUFFIXES.values()), key=os.path.getmtime)
+        size = sum(p.stat().st_size for p in entries)
+        while entries and size > self.max_bytes:
+            entry = entries.pop(0)
+            size -= entry.stat().st_size
+            entry.unlink()
@@ -0,0 +1,154 @@
+"""Conditional logit for the forced choice between the packages of a round."""
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+
+from analysis.design import design_matrix
+from analysis.estimation import Estimates, cluster_covariance, clusterings, wald_fvalue
+from analysis.registry import explanatory_variables
+
+
+def choice_tasks(data, chosen="chosen", task=("ID", "round")):
+    """Order the rows by choice task and keep the tasks with exactly one choice.
+
+    Args:
+        data (pandas.DataFrame): Regression data, one row per package.
+        chosen (str): Name of the indicator of the chosen package.
+        task (tuple): Columns identifying a choice task.
+
+    Returns:
+        tuple: The rows of the kept tasks, ordered by task, and the position of the first
+            row of every task.
+
+    """
+    codes, _ = pd.factorize(pd.MultiIndex.from_frame(data[list(task)]))
+    order = np.argsort(codes, kind="stable")
+    codes, data = codes[order], data.iloc[order]
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    n_chosen = np.add.reduceat(data[chosen].to_numpy(dtype=np.int64), starts)
+    keep = np.repeat(n_chosen == 1, np.diff(np.r_[starts, len(codes)]))
+    data = data[keep]
+
+    kept_codes = codes[keep]
+    starts = np.flatnonzero(np.r_[True, kept_codes[1:] != kept_codes[:-1]])
+    return data, starts
+
+
+def _probabilities(eta, starts):
+    """Choice probabilities within every task (softmax over contiguous rows)."""
+    sizes = np.diff(np.r_[starts, len(eta)])
+    eta = eta - np.repeat(np.maximum.reduceat(eta, starts), sizes)
+    expo = np.exp(eta)
+    denom = np.add.reduceat(expo, starts)
+    return expo / np.repeat(denom, sizes), eta, np.log(denom)
+
+
+def fit_conditional_logit(data, explanatory_vars, chosen="chosen", task=("ID", "round"), groups="ID", start=None, tol=1e-10, max_iter=100):
+    """Fit a conditional logit model of the choice between the packages of a round.
+
+    The log-likelihood, its gradient X'(y - p) and its Hessian
+    -(X'diag(p)X - sum_t xbar_t xbar_t') are computed in vectorized form over rows
+    ordered by task, and maximized by Newton's method with step halving. Only variables
+    that vary between the packages of a task are identified, so no constant is added.
+    Standard errors are clustered sandwich standard errors from ``cluster_covariance``.
+
+    Args:
+        data (pandas.DataFrame): Regression data, one row per package.
+        explanatory_vars (list): Explanatory variables (attribute level dummies).
+        chosen (str): Name of the indicator of the chosen package. Tasks without exactly
+            one chosen package (e.g. 'None of them') are left out.
+        task (tuple): Columns identifying a choice task.
+        groups (str or list): Cluster variable(s), see ``clusterings``.
+        start (pandas.Series, optional): Starting values, e.g. the estimates of a
+            nested model. Missing variables start at zero.
+        tol (float): Convergence tolerance on the Newton decrement.
+        max_iter (int): Maximum number of Newton steps.
+
+    Returns:
+        Estimates: The estimates. ``nobs`` is the number of choice tasks, ``rsquared``
+            McFadden's pseudo R-squared and ``fvalue`` the Wald statistic of all
+            coefficients divided by their number.
+
+    """
+    data, starts = choice_tasks(data, chosen, task)
+    X = design_matrix(data, explanatory_vars, constant=False, sparse=True).matrix.astype(np.float64).tocsr()
+    y = data[chosen].to_numpy(dtype=np.float64)
+    T = sp.csr_matrix(
+        (np.ones(len(y)), (np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(y)])), np.arange(len(y)))),
+        shape=(len(starts), len(y)),
+    )
+
+    def evaluate(params):
+        p, eta, log_denom = _probabilities(X @ params, starts)
+        loglike = y @ eta - log_denom.sum()
+        return loglike, p
+
+    def inverse_information(p):
+        xbar = T @ X.multiply(p[:, None])
+        xbar = xbar.toarray() if sp.issparse(xbar) else xbar
+        information = (X.T @ X.multiply(p[:, None])).toarray() - xbar.T @ xbar
+        return np.linalg.pinv(information, rcond=1e-10, hermitian=True)
+
+    params = np.zeros(X.shape[1]) if start is None else start.reindex(explanatory_vars).fillna(0).to_numpy()
+    loglike, p = evaluate(params)
+    for _ in range(max_iter):
+        gradient = X.T @ (y - p)
+        step = inverse_information(p) @ gradient
+        decrement = gradient @ step
+
+        # Step halving keeps every Newton step an ascent step
+        size = 1.0
+        while True:
+            new_loglike, new_p = evaluate(params + size * step)
+            if new_loglike >= loglike - 1e-12 or size < 1e-8:
+                break
+            size /= 2
+        params, loglike, p = params + size * step, new_loglike, new_p
+        if decrement / 2 < tol:
+            break
+    else:
+        warnings.warn(f"Conditional logit did not converge in {max_iter} iterations.")
+
+    cov = cluster_covariance(X, y - p, inverse_information(p), clusterings(data[groups].to_numpy()))
+    loglike_null = -np.log(np.diff(np.r_[starts, len(y)])).sum()
+
+    return Estimates(
+        params=pd.Series(params, index=explanatory_vars),
+        bse=pd.Series(np.sqrt(np.diag(cov)), index=explanatory_vars),
+        cov=pd.DataFrame(cov, index=explanatory_vars, columns=explanatory_vars),
+        nobs=len(starts),
+        rsquared=1 - loglike / loglike_null,
+        fvalue=wald_fvalue(params, cov),
+    )
+
+
+def fit_conditional_logits(data, names, registry, groups="ID"):
+    """Fit the conditional logit of several registered models with warm starts.
+
+    Only the attribute levels of a model enter the conditional logit; respondent-level
+    controls do not vary within a task. Models are fitted on their registered subgroup.
+    Every model starts from the estimates of the previous one, so nested models (e.g.
+    model1, model2, model3) converge in few steps.
+
+    Args:
+        data (pandas.DataFrame): Regression data, one row per package.
+        names (list): Names of the models in the registry, in fitting order.
+        registry (dict): The model registry.
+        groups (str or list): Cluster variable(s), see ``clusterings``.
+
+    Returns:
+        dict: Maps model names to their ``Estimates``.
+
+    """
+    estimates, start = {}, None
+    for name in names:
+        attributes = [x for x in explanatory_variables(data.columns, name, registry) if x.startswith("att")]
+        rows = np.ones(len(data), dtype=bool)
+        for variable, value in (registry["models"][name].get("subgroup") or {}).items():
+            rows &= data[variable].to_numpy() == value
+        estimates[name] = fit_conditional_logit(data[rows], attributes, groups=groups, start=start)
+        start = estimates[name].params
+    return estimates
@@ -0,0 +1,66 @@
+"""Compact design matrices for the regression models."""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+
+Design = namedtuple("Design", ["matrix", "columns"])
+Design.__doc__ = """Design matrix and the position of every named column in it.
+
+Attributes:
+    matrix (numpy.ndarray or scipy.sparse.csr_matrix): The design matrix.
+    columns (dict): Maps column names to column positions.
+
+"""
+
+
+def design_matrix(data, columns, constant=True, sparse=False):
+    """Build a compact design matrix from indicator and small integer columns.
+
+    Indicators are not cast to int64 column by column; the matrix is filled once with
+    the smallest dtype holding all values (uint8 for the attribute, district and control
+    columns of this project), or as a sparse matrix holding only the non-zero entries.
+
+    Args:
+        data (pandas.DataFrame): Data holding the columns.
+        columns (list): Names of the explanatory columns.
+        constant (bool): Whether to prepend a constant named ``const``.
+        sparse (bool): Whether to return a scipy.sparse.csr_matrix.
+
+    Returns:
+        Design: The design matrix and its column dictionary.
+
+    """
+    names = ["const"] * constant + list(columns)
+    values = [np.ones(len(data), dtype=np.uint8)] * constant
+    values += [np.asarray(data[column]) for column in columns]
+    values = [v.astype(np.uint8) if v.dtype == bool else v for v in values]
+    dtype = np.uint8 if all(_fits_uint8(v) for v in values) else np.float64
+
+    if sparse:
+        rows, cols, entries = [], [], []
+        for j, v in enumerate(values):
+            nonzero = np.flatnonzero(v)
+            rows.append(nonzero)
+            cols.append(np.full(nonzero.size, j))
+            entries.append(v[nonzero].astype(dtype))
+        matrix = sp.csr_matrix(
+            (np.concatenate(entries), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(data), len(names)),
+        )
+    else:
+        matrix = np.empty((len(data), len(names)), dtype=dtype)
+        for j, v in enumerate(values):
+            matrix[:, j] = v
+
+    return Design(matrix, {name: j for j, name in enumerate(names)})
+
+
+def _fits_uint8(values):
+    if not np.issubdtype(values.dtype, np.number):
+        values = pd.to_numeric(values)
+    if values.size == 0:
+        return True
+    return bool(np.all(np.mod(values, 1) == 0) and values.min() >= 0 and values.max() <= 255)
+
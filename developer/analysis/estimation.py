@@ -0,0 +1,225 @@
+"""Batch estimation of nested linear probability models."""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+
+from analysis.design import design_matrix
+
+# Version of the estimators, part of the keys of cached results. Increase it whenever a
+# change to the estimation code changes results.
+ESTIMATOR_VERSION = 2
+
+
+class Estimates(namedtuple("Estimates", ["params", "bse", "cov", "nobs", "rsquared", "fvalue"])):
+    """Estimates of a linear probability model with clustered standard errors.
+
+    Exposes the same attributes as the statsmodels results used for the tables and
+    figures (``params``, ``bse``, ``nobs``, ``rsquared``, ``fvalue``), without
+    storing the data. Stored as a small ``.npz`` file, see ``save`` and
+    ``load_estimates``.
+
+    Attributes:
+        params (pandas.Series): Coefficients.
+        bse (pandas.Series): Clustered standard errors.
+        cov (pandas.DataFrame): Clustered covariance matrix of the coefficients.
+        nobs (int): Number of observations.
+        rsquared (float): R-squared.
+        fvalue (float): F-statistic of the joint test that all coefficients but the
+            constant are zero, based on the clustered covariance.
+
+    """
+
+    def save(self, path):
+        """Write the estimates to an ``.npz`` file at path."""
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                names=np.asarray(self.params.index, dtype=str),
+                params=self.params.to_numpy(),
+                bse=self.bse.to_numpy(),
+                cov=self.cov.to_numpy(),
+                nobs=self.nobs,
+                rsquared=self.rsquared,
+                fvalue=self.fvalue,
+            )
+
+
+def load_estimates(path):
+    """Load estimates written by ``Estimates.save``.
+
+    Args:
+        path (str or pathlib.Path): Path to the ``.npz`` file.
+
+    Returns:
+        Estimates: The estimates.
+
+    """
+    with np.load(path, allow_pickle=False) as stored:
+        names = stored["names"].tolist()
+        return Estimates(
+            params=pd.Series(stored["params"], index=names),
+            bse=pd.Series(stored["bse"], index=names),
+            cov=pd.DataFrame(stored["cov"], index=names, columns=names),
+            nobs=stored["nobs"].item(),
+            rsquared=stored["rsquared"].item(),
+            fvalue=stored["fvalue"].item(),
+        )
+
+
+def cluster_indicator(groups):
+    """Sparse (n_clusters x n) matrix summing observations by cluster.
+
+    Args:
+        groups (array-like): Cluster label of every observation.
+
+    Returns:
+        scipy.sparse.csr_matrix: The indicator matrix.
+
+    """
+    codes, uniques = pd.factorize(np.asarray(groups))
+    n = codes.size
+    return sp.csr_matrix((np.ones(n), (codes, np.arange(n))), shape=(len(uniques), n))
+
+
+def clusterings(groups):
+    """Cluster indicators of the components of a one- or two-way clustered covariance.
+
+    Two-way clustered covariances combine the covariances clustered by each dimension
+    and by their intersection as ``cov_0 + cov_1 - cov_01`` (Cameron, Gelbach and
+    Miller, 2011), as statsmodels does.
+
+    Args:
+        groups (array-like): Cluster labels, one column per clustering dimension (one or
+            two columns, or a 1-D array for one-way clustering).
+
+    Returns:
+        list: Tuples of a cluster indicator (see ``cluster_indicator``) and the sign of
+            its component.
+
+    """
+    groups = np.asarray(groups)
+    if groups.ndim == 1 or groups.shape[1] == 1:
+        return [(cluster_indicator(groups.reshape(len(groups), -1)[:, 0]), 1)]
+    if groups.shape[1] != 2:
+        raise ValueError("Clustering is supported in one or two dimensions.")
+
+    codes_0, uniques_0 = pd.factorize(groups[:, 0])
+    codes_1, _ = pd.factorize(groups[:, 1])
+    intersection = codes_0.astype(np.int64) * len(uniques_0) + codes_1
+    return [(cluster_indicator(codes_0), 1), (cluster_indicator(codes_1), 1), (cluster_indicator(intersection), -1)]
+
+
+def cluster_correction(n_groups, n, k):
+    """Small sample correction of statsmodels' clustered covariance."""
+    return n_groups / (n_groups - 1) * (n - 1) / (n - k)
+
+
+def cluster_covariance(X, resid, bread, clusters):
+    """Cluster-robust sandwich covariance.
+
+    The scores are summed by cluster with a sparse indicator product, which is linear in
+    the number of observations whatever the number of clusters and keeps sparse designs
+    sparse.
+
+    Args:
+        X (numpy.ndarray or scipy.sparse matrix): Design matrix.
+        resid (numpy.ndarray): Residuals.
+        bread (numpy.ndarray): (Pseudo-)inverse of X'X.
+        clusters (list): Cluster indicators returned by ``clusterings``, which can be
+            shared by all models fitted on the same observations.
+
+    Returns:
+        numpy.ndarray: The clustered covariance matrix.
+
+    """
+    n, k = X.shape
+    weighted = X.multiply(resid[:, None]).tocsc() if sp.issparse(X) else X * resid[:, None]
+
+    cov = np.zeros((k, k))
+    for H, sign in clusters:
+        scores = H @ weighted
+        scores = scores.toarray() if sp.issparse(scores) else scores
+        cov += sign * cluster_correction(H.shape[0], n, k) * bread @ (scores.T @ scores) @ bread
+    return cov
+
+
+def fit_ols_batch(data, specifications, outcome="support", groups="ID"):
+    """Fit several linear probability models whose regressors are subsets of one design.
+
+    The design matrix of all regressors, its Gram matrix X'X and X'y are built once. Each
+    specification is solved from the corresponding sub-blocks, with the pseudo-inverse
+    so that rank-deficient designs give the same (minimum norm) solution as statsmodels.
+    Clustered covariances come from ``cluster_covariance``, with the small sample
+    correction of statsmodels' ``cov_type='cluster'``.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        specifications (dict): Maps model names to lists of explanatory variables. A
+            constant is added to every model.
+        outcome (str): Name of the outcome.
+        groups (str or list): Name of the cluster variable, or names of two cluster
+            variables for two-way clustering.
+
+    Returns:
+        dict: Maps model names to ``Estimates``.
+
+    """
+    columns = list(dict.fromkeys(c for explanatory_vars in specifications.values() for c in explanatory_vars))
+    design = design_matrix(data, columns, sparse=True)
+    y = data[outcome].to_numpy(dtype=np.float64)
+    return solve_ols_batch(design, y, specifications, clusterings(data[groups].to_numpy()))
+
+
+def solve_ols_batch(design, y, specifications, clusters):
+    """Solve several linear probability models from the Gram matrix of one design.
+
+    Args:
+        design (analysis.design.Design): Design holding a constant ``const`` and every
+            regressor of the specifications.
+        y (numpy.ndarray): Outcome.
+        specifications (dict): Maps model names to lists of explanatory variables. A
+            constant is added to every model.
+        clusters (list): Clusterings as returned by ``clusterings``.
+
+    Returns:
+        dict: Maps model names to ``Estimates``.
+
+    """
+    X = design.matrix.astype(np.float64).tocsc()
+    gram = (X.T @ X).toarray()
+    Xy = X.T @ y
+    tss = ((y - y.mean()) ** 2).sum()
+    n = len(y)
+
+    results = {}
+    for name, explanatory_vars in specifications.items():
+        names = ["const"] + list(explanatory_vars)
+        idx = [design.columns[c] for c in names]
+        X_s = X[:, idx]
+
+        bread = np.linalg.pinv(gram[np.ix_(idx, idx)], rcond=1e-10, hermitian=True)
+        params = bread @ Xy[idx]
+        resid = y - X_s @ params
+        cov = cluster_covariance(X_s, resid, bread, clusters)
+
+        results[name] = Estimates(
+            params=pd.Series(params, index=names),
+            bse=pd.Series(np.sqrt(np.diag(cov)), index=names),
+            cov=pd.DataFrame(cov, index=names, columns=names),
+            nobs=n,
+            rsquared=1 - (resid**2).sum() / tss,
+            fvalue=wald_fvalue(params[1:], cov[1:, 1:]),
+        )
+
+    return results
+
+
+def wald_fvalue(params, cov):
+    """F-statistic of the Wald test that all params are zero, as in statsmodels'
+    robust ``fvalue`` (the rank of cov replaces the number of restrictions if cov is
+    singular)."""
+    if params.size == 0:
+        return np.nan
+    return float(params @ np.linalg.pinv(cov) @ params / np.linalg.matrix_rank(cov))
@@ -0,0 +1,121 @@
+"""Average component interaction effects (ACIE) of all pairs of attributes."""
+import re
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+from scipy import stats
+
+from analysis.design import Design, design_matrix
+from analysis.estimation import clusterings, solve_ols_batch
+
+
+def attribute_levels(columns, reference_levels):
+    """Non-reference levels of every attribute.
+
+    Args:
+        columns (list): Columns of the regression data.
+        reference_levels (list): Reference levels left out of the models.
+
+    Returns:
+        dict: Maps every attribute (e.g. ``att_1``) to the names of its level dummies.
+
+    """
+    levels = {}
+    for column in columns:
+        match = re.match(r"^(att_\d+)_", column)
+        if match and column not in reference_levels:
+            levels.setdefault(match.group(1), []).append(column)
+    return levels
+
+
+def interaction_design(data, levels, pairs, controls=()):
+    """Sparse design of the main effects and the interactions of pairs of attributes.
+
+    Interaction columns are element-wise products of the sparse level dummies, named
+    ``level_a:level_b``, so the design of all pairs only stores the non-zero entries.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        levels (dict): Levels of every attribute, see ``attribute_levels``.
+        pairs (list): Pairs of attributes to interact.
+        controls (list): Further explanatory variables.
+
+    Returns:
+        Design: The design with a constant, all main effects, the controls and the
+            interactions of every pair.
+
+    """
+    main = [name for names in levels.values() for name in names] + list(controls)
+    design = design_matrix(data, main, sparse=True)
+    X = design.matrix.tocsc()
+
+    names, products = [], []
+    for a, b in pairs:
+        for level_a in levels[a]:
+            for level_b in levels[b]:
+                names.append(f"{level_a}:{level_b}")
+                products.append(X[:, design.columns[level_a]].multiply(X[:, design.columns[level_b]]))
+
+    matrix = sp.hstack([X] + products, format="csr")
+    columns = {**design.columns, **{name: len(design.columns) + j for j, name in enumerate(names)}}
+    return Design(matrix, columns)
+
+
+def fit_interactions(data, registry, controls=False, outcome=None, groups="ID", level=0.95):
+    """Estimate the ACIE of every pair of attributes.
+
+    The model of a pair regresses the outcome on the main effects of all attributes
+    (and the controls) plus the interactions of the levels of the two attributes. All
+    models are subsets of one design holding every interaction, so its Gram matrix is
+    built once and every model is solved from its sub-blocks by ``solve_ols_batch``.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        registry (dict): The model registry, for the reference levels and controls.
+        controls (bool): Whether to include the controls.
+        outcome (str, optional): Name of the outcome. Defaults to the registry outcome.
+        groups (str or list): Cluster variable(s), see ``clusterings``.
+        level (float): Confidence level of the intervals.
+
+    Returns:
+        pandas.DataFrame: One row per interaction of two levels, with the attributes and
+            levels, the estimate, its clustered standard error, confidence interval and
+            p-value.
+
+    """
+    levels = attribute_levels(data.columns, registry["reference_levels"])
+    pairs = list(combinations(levels, 2))
+    control_vars = registry["controls"] if controls else []
+    design = interaction_design(data, levels, pairs, control_vars)
+
+    main = [name for names in levels.values() for name in names] + control_vars
+    specifications = {
+        (a, b): main + [f"{level_a}:{level_b}" for level_a in levels[a] for level_b in levels[b]]
+        for a, b in pairs
+    }
+    y = data[outcome or registry["outcome"]].to_numpy(dtype=np.float64)
+    estimates = solve_ols_batch(design, y, specifications, clusterings(data[groups].to_numpy()))
+
+    z = stats.norm.ppf(1 - (1 - level) / 2)
+    rows = []
+    for (a, b), estimate in estimates.items():
+        for level_a in levels[a]:
+            for level_b in levels[b]:
+                term = f"{level_a}:{level_b}"
+                b_hat, se = estimate.params[term], estimate.bse[term]
+                rows.append(
+                    {
+                        "attribute_a": a,
+                        "level_a": level_a[len(a) + 1:],
+                        "attribute_b": b,
+                        "level_b": level_b[len(b) + 1:],
+                        "estimate": b_hat,
+                        "se": se,
+                        "lower": b_hat - z * se,
+                        "upper": b_hat + z * se,
+                        "p_value": 2 * stats.norm.sf(abs(b_hat / se)),
+                    }
+                )
+    return pd.DataFrame(rows)
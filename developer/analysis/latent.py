@@ -0,0 +1,178 @@
+"""Latent-class segmentation of the respondents by the EM algorithm."""
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+from analysis.design import design_matrix
+from analysis.estimation import cluster_indicator, fit_ols_batch
+from analysis.model import cube_marginal_means, marginal_means_cube
+from analysis.registry import explanatory_variables
+
+# Design, outcome and respondent indicator of the worker processes, set once per worker
+_statistics = None
+
+LatentClasses = namedtuple(
+    "LatentClasses", ["params", "shares", "responsibilities", "loglike", "n_iter", "converged"]
+)
+LatentClasses.__doc__ = """Estimates of a latent-class logit model.
+
+Attributes:
+    params (pandas.DataFrame): Logit coefficients, one column per class.
+    shares (pandas.Series): Class shares.
+    responsibilities (pandas.DataFrame): Posterior class probabilities, one row per
+        respondent (indexed by ID) and one column per class.
+    loglike (float): Log-likelihood.
+    n_iter (int): Number of EM iterations.
+    converged (bool): Whether the tolerance was reached within the iteration cap.
+
+"""
+
+
+def _init_worker(statistics):
+    global _statistics
+    _statistics = statistics
+
+
+def _em(seed, n_classes, tol, max_iter):
+    """One EM run from random responsibilities.
+
+    The M-step takes one Newton step of the weighted logit of every class at once,
+    halved for the classes where it would lower their weighted log-likelihood, so the
+    log-likelihood never decreases (generalized EM). The E-step updates the
+    respondents x classes responsibilities from the per-respondent log-likelihoods,
+    summed with the sparse respondent indicator.
+    """
+    X, y, H = _statistics
+    rng = np.random.default_rng(seed)
+    n_respondents, k = H.shape[0], X.shape[1]
+    responsibilities = rng.dirichlet(np.ones(n_classes), size=n_respondents)
+    params = np.zeros((k, n_classes))
+    loglike, converged = -np.inf, False
+
+    def weighted_loglike(params, weights):
+        eta = X @ params
+        return (weights * (y[:, None] * eta - np.logaddexp(0, eta))).sum(axis=0)
+
+    for n_iter in range(1, max_iter + 1):
+        # M-step: class shares and one Newton step of every class's weighted logit
+        shares = responsibilities.mean(axis=0)
+        weights = H.T @ responsibilities
+        p = special.expit(X @ params)
+        gradient = X.T @ (weights * (y[:, None] - p))
+        # Classes x k x k information matrices as one batched product, X' diag(w_c) X
+        information = (X.T * (weights * p * (1 - p)).T[:, None, :]) @ X
+        step = np.einsum("cij,jc->ic", np.linalg.pinv(information, rcond=1e-10, hermitian=True), gradient)
+
+        current, size = weighted_loglike(params, weights), np.ones(n_classes)
+        for _ in range(30):
+            worse = weighted_loglike(params + size * step, weights) < current
+            if not worse.any():
+                break
+            size[worse] /= 2
+        else:
+            size[worse] = 0
+        params += size * step
+
+        # E-step: responsibilities from the log-likelihood of every respondent and class
+        eta = X @ params
+        respondent_loglike = H @ (y[:, None] * eta - np.logaddexp(0, eta)) + np.log(shares)
+        total = special.logsumexp(respondent_loglike, axis=1)
+        responsibilities = np.exp(respondent_loglike - total[:, None])
+
+        new_loglike = total.sum()
+        if abs(new_loglike - loglike) < tol * abs(new_loglike):
+            loglike, converged = new_loglike, True
+            break
+        loglike = new_loglike
+
+    return loglike, params, shares, responsibilities, n_iter, converged
+
+
+def fit_latent_classes(data, explanatory_vars, n_classes=2, outcome="support", n_restarts=20, seed=0, tol=1e-8, max_iter=500, max_workers=None):
+    """Segment the respondents into latent classes with their own logit of the outcome.
+
+    Every respondent belongs to one class, in which the outcome of each of their rated
+    packages follows a logit model in the explanatory variables. The model is fitted by
+    EM from several random starts, run in a process pool, and the run with the highest
+    log-likelihood is kept. Classes are ordered by decreasing share.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        explanatory_vars (list): Explanatory variables. A constant is added.
+        n_classes (int): Number of classes.
+        outcome (str): Name of the binary outcome.
+        n_restarts (int): Number of random starts.
+        seed (int): Seed of the random starts.
+        tol (float): Tolerance on the relative change of the log-likelihood.
+        max_iter (int): Maximum number of EM iterations per start.
+        max_workers (int, optional): Number of processes. Defaults to the number of
+            cores. With 1, the starts run in the current process.
+
+    Returns:
+        LatentClasses: The estimates of the best start.
+
+    """
+    X = design_matrix(data, explanatory_vars).matrix.astype(np.float64)
+    y = data[outcome].to_numpy(dtype=np.float64)
+    H = cluster_indicator(data["ID"])
+    statistics = (X, y, H)
+
+    # Independent seeds, so results do not depend on the number of workers
+    seeds = np.random.SeedSequence(seed).spawn(n_restarts)
+    args = (seeds, [n_classes] * n_restarts, [tol] * n_restarts, [max_iter] * n_restarts)
+    if max_workers == 1:
+        _init_worker(statistics)
+        runs = list(map(_em, *args))
+    else:
+        max_workers = min(max_workers or os.cpu_count(), n_restarts)
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(statistics,)) as pool:
+            runs = list(pool.map(_em, *args))
+
+    loglike, params, shares, responsibilities, n_iter, converged = max(runs, key=lambda run: run[0])
+    order = np.argsort(-shares, kind="stable")
+    classes = [f"class_{c + 1}" for c in range(n_classes)]
+    return LatentClasses(
+        params=pd.DataFrame(params[:, order], index=["const"] + list(explanatory_vars), columns=classes),
+        shares=pd.Series(shares[order], index=classes),
+        responsibilities=pd.DataFrame(
+            responsibilities[:, order], index=pd.unique(data["ID"]), columns=classes
+        ).rename_axis("ID"),
+        loglike=loglike,
+        n_iter=n_iter,
+        converged=converged,
+    )
+
+
+def latent_class_tables(data, classes, registry, model="model3c"):
+    """Marginal means and AMCE of every latent class.
+
+    Respondents are assigned to their most likely class; the tables of a class are those
+    of the subgroup of its respondents, so they do not reflect the uncertainty of the
+    assignment.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        classes (LatentClasses): Estimates returned by ``fit_latent_classes``.
+        registry (dict): The model registry.
+        model (str): Name of the model of the AMCE in the registry.
+
+    Returns:
+        tuple: Dictionaries mapping every class to its marginal means (in the layout of
+            ``marginal_means``) and to the ``Estimates`` of its AMCE.
+
+    """
+    assignment = classes.responsibilities.idxmax(axis=1)
+    data = data.assign(latent_class=data["ID"].map(assignment).to_numpy())
+
+    cube = marginal_means_cube(data, ["latent_class"])
+    explanatory_vars = explanatory_variables(data.columns, model, registry)
+    marginal_means, amce = {}, {}
+    for name in classes.shares.index:
+        marginal_means[name] = cube_marginal_means(cube, latent_class=name)
+        members = data[data["latent_class"].to_numpy() == name]
+        amce[name] = fit_ols_batch(members, {model: explanatory_vars})[model]
+    return marginal_means, amce
@@ -1,190 +1,215 @@
 """Functions for fitting the regression model."""
+from collections import namedtuple
 
-from statsmodels.iolib.smpickle import load_pickle
-import statsmodels.api as sm
 import numpy as np
 import pandas as pd
 
+from analysis.cache import result_key, subgroup_hash
+from analysis.estimation import ESTIMATOR_VERSION, cluster_correction, cluster_indicator, clusterings, load_estimates
 
-def fit_model_1(data):
-    """Fit a linear probability model to data."""
-    outcome = 'support'
-    explanatory_vars = [col for col in data.columns if "att_1" in col]
 
-    # Having a reference category for each att:
-    to_remove = ['att_1_Eliminate2070', 'att_2_NothingSoc', 'att_3_NothingEco', 'att_4_GovAlone', 'att_5_NoInterference']
-    explanatory_vars = [x for x in explanatory_vars if x not in to_remove]
-
-
-    X = data[explanatory_vars].astype(int)
-    y = data[outcome].astype(int)
-
-    X = sm.add_constant(X)
-    model = sm.OLS(y, X).fit(cov_type='cluster', cov_kwds={'groups':data['ID']})
+def load_model(path):
+    """Load a stored model.
 
-    return model
+    Args:
+        path (str or pathlib.Path): Path to model file.
 
-def fit_model_1_c(data):
-    """Fit a linear probability model to data."""
-    outcome = 'support'
-    explanatory_vars = [col for col in data.columns if "att_1" in col] + ['ageFilter', 'genderFilter', 'district_NorthernZone', 
-                                                                            'district_NorthEasternZone', 'district_CentralZone', 'district_EasternZone',
-                                                                            'district_WesternZone', 'district_SouthernZone', 'treatment_status']
+    Returns:
+        analysis.estimation.Estimates: The stored model.
 
-    # Having a reference category for each att:
-    to_remove = ['att_1_Eliminate2070', 'att_2_NothingSoc', 'att_3_NothingEco', 'att_4_GovAlone', 'att_5_NoInterference']
-    explanatory_vars = [x for x in explanatory_vars if x not in to_remove]
+    """
+    return load_estimates(path)
 
+def cluster_sums(df, attributes_levels, H, outcome='support'):
+    """Per-cluster sums behind the marginal means.
 
-    X = data[explanatory_vars].astype(int)
-    y = data[outcome].astype(int)
+    Args:
+        df (pandas.DataFrame): Regression data.
+        attributes_levels (list): Attribute level dummies.
+        H (scipy.sparse.csr_matrix): Cluster indicator, see ``cluster_indicator``.
+        outcome (str): Name of the outcome.
 
-    X = sm.add_constant(X)
-    model = sm.OLS(y, X).fit(cov_type='cluster', cov_kwds={'groups':data['ID']})
+    Returns:
+        tuple: Number of rows and outcome sum per cluster (arrays of length n_clusters),
+            and the number of rows showing each level and the outcome sum over them per
+            cluster (arrays of shape n_clusters x n_levels).
 
-    return model
+    """
+    y = df[outcome].to_numpy(dtype=float)
+    X = df[attributes_levels].to_numpy(dtype=float)
+    return H @ np.ones(len(y)), H @ y, H @ X, H @ (X * y[:, None])
 
-def fit_model_2(data):
-    """Fit a linear probability model to data."""
-    outcome = 'support'
-    explanatory_vars = [col for col in data.columns if any(att in col for att in ["att_1", "att_2", "att_3"])]
 
+def respondent_sums(df, attributes_levels, outcome='support'):
+    """Per-respondent sums behind the marginal means, see ``cluster_sums``."""
+    return cluster_sums(df, attributes_levels, cluster_indicator(df['ID']), outcome)
 
-    # Having a reference category for each att:
-    to_remove = ['att_1_Eliminate2070', 'att_2_NothingSoc', 'att_3_NothingEco', 'att_4_GovAlone', 'att_5_NoInterference']
-    explanatory_vars = [x for x in explanatory_vars if x not in to_remove]
 
+def _marginal_means(rows, support, level_rows, level_support):
+    """Marginal means and clustered variances of all levels from cluster sums.
 
-    X = data[explanatory_vars].astype(int)
-    y = data[outcome].astype(int)
+    The marginal mean of a level is the share of supported packages among those showing
+    it. The variance is the one of the slope of a regression of the outcome on a
+    constant and the level dummy, clustered as statsmodels would report it. That
+    regression has a closed form: the slope is the difference between the means with
+    and without the level, and the clustered scores of a cluster are sums of deviations
+    from these two means.
 
-    X = sm.add_constant(X)
-    model = sm.OLS(y, X).fit(cov_type='cluster', cov_kwds={'groups':data['ID']})
+    Args:
+        rows, support, level_rows, level_support (numpy.ndarray): Per-cluster sums as
+            returned by ``cluster_sums``.
 
-    return model
+    Returns:
+        tuple: Marginal means and variances (arrays of length n_levels).
 
-def fit_model_2_c(data):
-    """Fit a linear probability model to data."""
-    outcome = 'support'
-    explanatory_vars = [col for col in data.columns if any(att in col for att in ["att_1", "att_2", "att_3"])] + ['ageFilter', 'genderFilter', 'district_NorthernZone', 
-                                                                            'district_NorthEasternZone', 'district_CentralZone', 'district_EasternZone',
-                                                                            'district_WesternZone', 'district_SouthernZone', 'treatment_status']
+    """
+    n, n_groups = rows.sum(), len(rows)
+    n1 = level_rows.sum(axis=0)
+    n0 = n - n1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = level_support.sum(axis=0) / n1
+        mean0 = (support.sum() - level_support.sum(axis=0)) / n0
 
-    # Having a reference category for each att:
-    to_remove = ['att_1_Eliminate2070', 'att_2_NothingSoc', 'att_3_NothingEco', 'att_4_GovAlone', 'att_5_NoInterference']
-    explanatory_vars = [x for x in explanatory_vars if x not in to_remove]
+        scores1 = level_support - mean1 * level_rows
+        scores0 = (support[:, None] - level_support) - mean0 * (rows[:, None] - level_rows)
+        influence = scores1 / n1 - scores0 / n0
+        variance = cluster_correction(n_groups, n, 2) * (influence**2).sum(axis=0)
 
+    return mean1, variance
 
-    X = data[explanatory_vars].astype(int)
-    y = data[outcome].astype(int)
 
-    X = sm.add_constant(X)
-    model = sm.OLS(y, X).fit(cov_type='cluster', cov_kwds={'groups':data['ID']})
+def _marginal_means_table(attributes_levels, mean, se, nobs):
+    return pd.DataFrame(
+        [mean.round(4), se.round(4), np.full(len(attributes_levels), nobs)],
+        columns=[f'{att_level}_MM' for att_level in attributes_levels],
+    )
 
-    return model
 
-def fit_model_3(data):
-    """Fit a linear probability model to data."""
-    outcome = 'support'
-    explanatory_vars = [col for col in data.columns if "att" in col]
+def marginal_means(df, groups='ID'):
+    """Marginal means of all attribute levels with clustered standard errors.
 
-    # Having a reference category for each att:
-    to_remove = ['att_1_Eliminate2070', 'att_2_NothingSoc', 'att_3_NothingEco', 'att_4_GovAlone', 'att_5_NoInterference']
-    explanatory_vars = [x for x in explanatory_vars if x not in to_remove]
+    All levels are computed at once from per-cluster sums instead of one regression
+    per level.
 
+    Args:
+        df (pandas.DataFrame): Regression data.
+        groups (str or list): Name of the cluster variable, or names of two cluster
+            variables for two-way clustering (e.g. ``['ID', 'round']``).
 
-    X = data[explanatory_vars].astype(int)
-    y = data[outcome].astype(int)
+    Returns:
+        pandas.DataFrame: One column ``{level}_MM`` per attribute level holding the
+            marginal mean, its standard error (both rounded to 4 digits) and the number of
+            respondents.
 
-    X = sm.add_constant(X)
-    model = sm.OLS(y, X).fit(cov_type='cluster', cov_kwds={'groups':data['ID']})
+    """
+    attributes_levels = df.columns[df.columns.str.startswith('att')]
+    variance = 0
+    for H, sign in clusterings(df[groups].to_numpy()):
+        mean, component = _marginal_means(*cluster_sums(df, attributes_levels, H))
+        variance = variance + sign * component
+    se = np.sqrt(variance)
+    nobs = len(df)/12
 
-    return model
+    return _marginal_means_table(attributes_levels, mean, se, nobs)
 
-def fit_model_3_c(data):
-    """Fit a linear probability model to data."""
-    outcome = 'support'
-    explanatory_vars = [col for col in data.columns if "att" in col] +  ['ageFilter', 'genderFilter', 'district_NorthernZone', 
-                                                                            'district_NorthEasternZone', 'district_CentralZone', 'district_EasternZone',
-                                                                            'district_WesternZone', 'district_SouthernZone', 'treatment_status']
 
-    # Having a reference category for each att:
-    to_remove = ['att_1_Eliminate2070', 'att_2_NothingSoc', 'att_3_NothingEco', 'att_4_GovAlone', 'att_5_NoInterference']
-    explanatory_vars = [x for x in explanatory_vars if x not in to_remove]
+MarginalMeansCube = namedtuple(
+    'MarginalMeansCube', ['levels', 'covariates', 'rows', 'support', 'level_rows', 'level_support']
+)
+MarginalMeansCube.__doc__ = """Per-respondent sufficient statistics of the marginal means.
 
+Attributes:
+    levels (pandas.Index): Attribute level dummies.
+    covariates (pandas.DataFrame): Respondent-level variables defining subgroups, one row
+        per respondent.
+    rows, support, level_rows, level_support (numpy.ndarray): Per-respondent sums as
+        returned by ``respondent_sums``.
 
-    X = data[explanatory_vars].astype(int)
-    y = data[outcome].astype(int)
+"""
 
-    X = sm.add_constant(X)
-    model = sm.OLS(y, X).fit(cov_type='cluster', cov_kwds={'groups':data['ID']})
 
-    return model
+def marginal_means_cube(df, covariates):
+    """Aggregate the regression data once into per-respondent sufficient statistics.
 
-def fit_model_support_c(data):
-    """Fit a linear probability model to data."""
+    Marginal means and clustered standard errors of any subgroup defined by
+    respondent-level variables can then be computed from the cube with
+    ``cube_marginal_means``, without going back to the row-level data.
 
-    outcome_name = 'support'
-    explanatory_vars = [col for col in data.columns if "att" in col] + ['ageFilter', 'genderFilter', 'district_NorthernZone', 
-                                                                        'district_NorthEasternZone', 'district_CentralZone', 'district_EasternZone',
-                                                                        'district_WesternZone', 'district_SouthernZone']
+    Args:
+        df (pandas.DataFrame): Regression data.
+        covariates (list): Respondent-level variables defining subgroups, e.g.
+            ``['treatment_status', 'trust_ID']``.
 
-    X = data[explanatory_vars].astype(int)
-    y = data[outcome_name].astype(int)
+    Returns:
+        MarginalMeansCube: The sufficient statistics.
 
-    X = sm.add_constant(X)
-    model = sm.OLS(y, X).fit(cov_type='cluster', cov_kwds={'groups': data['ID']})
+    """
+    attributes_levels = df.columns[df.columns.str.startswith('att')]
+    sums = respondent_sums(df, attributes_levels)
+    # Same respondent order as the cluster indicator (order of first appearance)
+    respondents = df.groupby('ID', sort=False)[covariates].first()
+    return MarginalMeansCube(attributes_levels, respondents, *sums)
 
-    return model
 
-def load_model(path):
-    """Load statsmodels model.
+def cube_marginal_means(cube, **conditions):
+    """Marginal means of a subgroup, assembled from the sufficient statistics.
 
     Args:
-        path (str or pathlib.Path): Path to model file.
+        cube (MarginalMeansCube): Cube returned by ``marginal_means_cube``.
+        **conditions: Subgroup definition as variable=value pairs, e.g.
+            ``trust_ID=1``. Without conditions, the marginal means of all respondents
+            are returned.
 
     Returns:
-        statsmodels.base.model.Results: The stored model.
+        pandas.DataFrame: The marginal means in the layout of ``marginal_means``.
 
     """
-    return load_pickle(path)
+    mask = np.ones(len(cube.rows), dtype=bool)
+    for variable, value in conditions.items():
+        mask &= cube.covariates[variable].to_numpy() == value
 
-def _calculate_conditional_probability(df, column_x, column_y):
+    sums = [cube.rows[mask], cube.support[mask], cube.level_rows[mask], cube.level_support[mask]]
+    mean, variance = _marginal_means(*sums)
+    se = np.sqrt(variance)
+    nobs = mask.sum()  # the cube holds one row per respondent
+
+    return _marginal_means_table(cube.levels, mean, se, nobs)
 
-    nobs = len(df)/12
-    # Step 1: Count occurrences of X=1 and Y=1 simultaneously
-    xy_count = ((df[column_x] == True) & (df[column_y] == True)).sum()
-    
-    # Step 2: Count occurrences of X=1
-    x_count = (df[column_x] == True).sum()
-    
-    # Step 3: Calculate P(Y=1|X=1)
-    if x_count > 0:
-        probability_y_given_x = xy_count / x_count
-        probability_y_given_x = probability_y_given_x.round(4)
-    else:
-        probability_y_given_x = np.nan
-    
-    # Step 4: Calculate clustered standard deviation
-    X = df[[column_x]].astype(float)
-    X = sm.add_constant(X)
-    model = sm.OLS(df[column_y], X)
-    clustered_se = model.fit(cov_type='cluster', cov_kwds={'groups': df['ID']}).bse[1].round(4)
-    
-    return probability_y_given_x, clustered_se, nobs
-
-def marginal_means(df): 
-    attributes_levels = df.columns[df.columns.str.startswith('att')]
 
-    outcome = 'support'
+def subgroup_marginal_means(df, subgroups, cache=None):
+    """Marginal means of several subgroups, reusing cached tables.
 
-    marginal_means ={}
+    Tables are cached under the estimator version, the subgroup definition and the
+    values of the attribute, outcome and respondent columns of the subgroup's rows. The
+    cube is only built if a table is missing.
 
-    for att_level in attributes_levels:
-        results = _calculate_conditional_probability(df, att_level, outcome)
-        marginal_means[f'{att_level}_MM'] = []
-        marginal_means[f'{att_level}_MM'].append(results[0])
-        marginal_means[f'{att_level}_MM'].append(results[1])
-        marginal_means[f'{att_level}_MM'].append(results[2])
+    Args:
+        df (pandas.DataFrame): Regression data.
+        subgroups (dict): Maps table names to subgroup definitions (dicts of
+            variable-value pairs of respondent-level variables).
+        cache (analysis.cache.ResultCache, optional): Cache of tables.
+
+    Returns:
+        dict: Maps table names to marginal means as returned by ``marginal_means``.
 
-    return pd.DataFrame(marginal_means)
+    """
+    columns = list(df.columns[df.columns.str.startswith('att')]) + ['support', 'ID']
+    tables, keys = {}, {}
+    if cache is not None:
+        for name, conditions in subgroups.items():
+            data_hash = subgroup_hash(df, columns, conditions)
+            keys[name] = result_key('marginal_means', ESTIMATOR_VERSION, sorted(conditions.items()), data_hash)
+            cached = cache.get(keys[name])
+            if cached is not None:
+                tables[name] = cached
+
+    missing = [name for name in subgroups if name not in tables]
+    if missing:
+        covariates = sorted({variable for name in missing for variable in subgroups[name]})
+        cube = marginal_means_cube(df, covariates)
+        for name in missing:
+            tables[name] = cube_marginal_means(cube, **subgroups[name])
+            if cache is not None:
+                cache.put(keys[name], tables[name])
+
+    return {name: tables[name] for name in subgroups}
@@ -0,0 +1,217 @@
+"""Ordered probit and logit models of the 7-point utility rating."""
+import warnings
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+from scipy import special, stats
+
+from analysis.design import design_matrix
+from analysis.estimation import Estimates, cluster_covariance, clusterings, wald_fvalue
+from analysis.parallel import run_subgroup_jobs
+from analysis.registry import plan_fits
+
+
+def _normal_density_slope(z):
+    z = np.where(np.isfinite(z), z, 0.0)  # the density is zero at the infinite bounds
+    return -z * stats.norm.pdf(z)
+
+
+def _logistic_density(z):
+    F = special.expit(z)
+    return F * (1 - F)
+
+
+def _logistic_density_slope(z):
+    F = special.expit(z)
+    return F * (1 - F) * (1 - 2 * F)
+
+
+# Distribution function, density and slope of the density of every link
+LINKS = {
+    "probit": (stats.norm.cdf, stats.norm.pdf, _normal_density_slope),
+    "logit": (special.expit, _logistic_density, _logistic_density_slope),
+}
+
+
+def _fit_ordered(X, names, codes, categories, clusters, link, start, tol, max_iter):
+    """Fit one ordered model from its sparse design and the category codes of the outcome."""
+    cdf, pdf, pdf_slope = LINKS[link]
+    n, k = X.shape
+    n_cuts = len(categories) - 1
+    cut_names = [f"cut_{a:g}/{b:g}" for a, b in zip(categories[:-1], categories[1:])]
+
+    # Derivatives of the upper and lower bound of the latent interval of every
+    # observation, c_y - x'b and c_{y-1} - x'b, with respect to (b, c)
+    upper, lower = codes < n_cuts, codes > 0
+    E_upper = sp.csr_matrix((np.ones(upper.sum()), (np.flatnonzero(upper), codes[upper])), shape=(n, n_cuts))
+    E_lower = sp.csr_matrix((np.ones(lower.sum()), (np.flatnonzero(lower), codes[lower] - 1)), shape=(n, n_cuts))
+    A = sp.hstack([-X, E_upper], format="csr")
+    B = sp.hstack([-X, E_lower], format="csr")
+
+    def evaluate(params):
+        cuts = params[k:]
+        if np.any(np.diff(cuts) <= 0):
+            return -np.inf, None
+        eta = X @ params[:k]
+        bounds = np.r_[-np.inf, cuts, np.inf]
+        u, l = bounds[codes + 1] - eta, bounds[codes] - eta
+        prob = cdf(u) - cdf(l)
+        if np.any(prob <= 0):
+            return -np.inf, None
+        return np.log(prob).sum(), (u, l, prob)
+
+    def derivatives(state):
+        u, l, prob = state
+        scores = A.multiply((pdf(u) / prob)[:, None]) - B.multiply((pdf(l) / prob)[:, None])
+        scores = scores.tocsr()
+        hessian = (
+            (A.T @ A.multiply((pdf_slope(u) / prob)[:, None])).toarray()
+            - (B.T @ B.multiply((pdf_slope(l) / prob)[:, None])).toarray()
+            - (scores.T @ scores).toarray()
+        )
+        if np.linalg.matrix_rank(hessian, hermitian=True) < hessian.shape[0]:
+            raise np.linalg.LinAlgError(
+                f"The Hessian of the ordered {link} is singular; the explanatory variables are collinear with "
+                "each other or with the thresholds."
+            )
+        return scores, np.asarray(scores.sum(axis=0)).ravel(), np.linalg.inv(-hessian)
+
+    # Start from the thresholds of the marginal distribution of the outcome
+    share = np.cumsum(np.bincount(codes, minlength=n_cuts + 1))[:-1] / n
+    params = np.r_[np.zeros(k), stats.norm.ppf(share) if link == "probit" else special.logit(share)]
+    if start is not None:
+        known = pd.Series(params, index=names + cut_names)
+        known.update(start.reindex(known.index).dropna())
+        params = known.to_numpy()
+
+    loglike, state = evaluate(params)
+    for _ in range(max_iter):
+        _, gradient, bread = derivatives(state)
+        step = bread @ gradient
+        decrement = gradient @ step
+
+        # Step halving keeps every Newton step an ascent step with increasing thresholds
+        size = 1.0
+        while True:
+            new_loglike, new_state = evaluate(params + size * step)
+            if new_loglike >= loglike - 1e-12 or size < 1e-8:
+                break
+            size /= 2
+        if new_state is not None:
+            params, loglike, state = params + size * step, new_loglike, new_state
+        if decrement / 2 < tol:
+            break
+    else:
+        warnings.warn(f"Ordered {link} did not converge in {max_iter} iterations.")
+
+    # The scores play the role of the weighted design in the sandwich
+    scores, _, bread = derivatives(state)
+    cov = cluster_covariance(scores, np.ones(n), bread, clusters)
+    counts = np.bincount(codes)
+    loglike_null = counts @ np.log(counts / n)
+
+    index = names + cut_names
+    return Estimates(
+        params=pd.Series(params, index=index),
+        bse=pd.Series(np.sqrt(np.diag(cov)), index=index),
+        cov=pd.DataFrame(cov, index=index, columns=index),
+        nobs=n,
+        rsquared=1 - loglike / loglike_null,
+        fvalue=wald_fvalue(params[:k], cov[:k, :k]),
+    )
+
+
+def _identified_variables(data, explanatory_vars):
+    """Leave out the variables that are zero in every row, and the first dummy of every
+    set of dummies (named ``prefix_level``) that sums to one in every row, such as the
+    district dummies."""
+    values = data[explanatory_vars].to_numpy(dtype=np.float64)
+    explanatory_vars = [column for column, nonzero in zip(explanatory_vars, values.any(axis=0)) if nonzero]
+    sets = {}
+    for column in explanatory_vars:
+        sets.setdefault(column.rsplit("_", 1)[0], []).append(column)
+    references = {
+        columns[0] for columns in sets.values() if np.all(data[columns].to_numpy(dtype=np.float64).sum(axis=1) == 1)
+    }
+    return [column for column in explanatory_vars if column not in references]
+
+
+def fit_ordered_batch(data, specifications, outcome="utility", link="probit", groups="ID", tol=1e-10, max_iter=100):
+    """Fit ordered models of several specifications whose regressors are subsets of one design.
+
+    The log-likelihood, its gradient and its Hessian are evaluated in vectorized form
+    from the bounds of the latent interval of every observation, and maximized by
+    Newton's method with step halving. The design matrix and the cluster indicators are
+    built once, and every model starts from the estimates of the previous one. Standard
+    errors are clustered sandwich standard errors from ``cluster_covariance``.
+
+    Args:
+        data (pandas.DataFrame): Regression data. Rows with a missing outcome are left
+            out.
+        specifications (dict): Maps model names to lists of explanatory variables. No
+            constant is added; the thresholds take its place, so the first dummy of
+            every set of dummies summing to one (e.g. the district dummies) is left out
+            as reference. Variables that are zero in all rows, such as the districts
+            absent from a subgroup, are left out as well.
+        outcome (str): Name of the ordinal outcome.
+        link (str): 'probit' or 'logit'.
+        groups (str or list): Cluster variable(s), see ``clusterings``.
+        tol (float): Convergence tolerance on the Newton decrement.
+        max_iter (int): Maximum number of Newton steps.
+
+    Returns:
+        dict: Maps model names to ``Estimates``. The parameters are the coefficients
+            followed by the thresholds ``cut_a/b`` between the categories a and b,
+            ``rsquared`` is McFadden's pseudo R-squared and ``fvalue`` the Wald statistic
+            of the coefficients divided by their number.
+
+    """
+    # Rows without a rating carry no information on the thresholds or coefficients
+    data = data[data[outcome].notna().to_numpy()]
+    columns = list(dict.fromkeys(c for explanatory_vars in specifications.values() for c in explanatory_vars))
+    design = design_matrix(data, columns, constant=False, sparse=True)
+    X = design.matrix.astype(np.float64).tocsc()
+    codes, categories = pd.factorize(data[outcome], sort=True)
+    clusters = clusterings(data[groups].to_numpy())
+
+    results, start = {}, None
+    for name, explanatory_vars in specifications.items():
+        explanatory_vars = _identified_variables(data, explanatory_vars)
+        idx = [design.columns[c] for c in explanatory_vars]
+        results[name] = _fit_ordered(
+            X[:, idx].tocsr(), list(explanatory_vars), codes, list(categories), clusters, link, start, tol, max_iter
+        )
+        start = results[name].params
+    return results
+
+
+def fit_ordered_registry(data, registry, names=None, outcome="utility", link="probit", groups="ID", max_workers=None):
+    """Fit the ordered models of registered specifications.
+
+    The models are grouped by subgroup as planned by ``plan_fits``; every subgroup is
+    one job of ``run_subgroup_jobs``, fitted by ``fit_ordered_batch``.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        registry (dict): The model registry.
+        names (list, optional): Models to fit. Defaults to all registered models.
+        outcome (str): Name of the ordinal outcome, replacing the registered outcome.
+        link (str): 'probit' or 'logit'.
+        groups (str or list): Cluster variable(s), see ``clusterings``.
+        max_workers (int, optional): Number of processes, see ``run_subgroup_jobs``.
+
+    Returns:
+        dict: Maps model names to their ``Estimates``.
+
+    """
+    names = list(registry["models"]) if names is None else names
+    plan = plan_fits(registry, data.columns, names)
+    jobs = {
+        i: (partial(fit_ordered_batch, specifications=group.specifications, outcome=outcome, link=link, groups=groups), group.subgroup)
+        for i, group in enumerate(plan)
+    }
+    results = run_subgroup_jobs(data, jobs, max_workers)
+    estimates = {name: results[i][shared] for i, group in enumerate(plan) for name, shared in group.aliases.items()}
+    return {name: estimates[name] for name in names}
@@ -0,0 +1,131 @@
+"""Parallel execution of independent subgroup estimations."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Data of the worker processes, attached to the shared memory block
+_shm = None
+_data = None
+
+
+def share_frame(data):
+    """Copy the columns of a DataFrame into one shared memory block.
+
+    Args:
+        data (pandas.DataFrame): Data with numeric or boolean columns.
+
+    Returns:
+        tuple: The ``multiprocessing.shared_memory.SharedMemory`` block and the layout
+            needed to view it as a DataFrame again (see ``frame_from_buffer``). The
+            caller is responsible for closing and unlinking the block.
+
+    """
+    columns, offset = [], 0
+    for column in data.columns:
+        dtype = data[column].dtype
+        if not _shareable(dtype):
+            raise TypeError(f"Column {column} of dtype {dtype} cannot be shared.")
+        columns.append((column, dtype.str, offset))
+        offset += -(-len(data) * dtype.itemsize // 8) * 8  # keep columns 8-byte aligned
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    layout = {"columns": columns, "n_rows": len(data)}
+    for column, view in zip(data.columns, _column_views(shm.buf, layout)):
+        view[:] = data[column].to_numpy()
+    return shm, layout
+
+
+def _shareable(dtype):
+    return isinstance(dtype, np.dtype) and dtype.kind in "biuf"
+
+
+def _numeric_frame(data):
+    """Keep the numeric and boolean columns, with numeric categoricals as their values."""
+    columns = {}
+    for column in data.columns:
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) and _shareable(values.cat.categories.dtype):
+            values = values.astype(np.float64 if values.isna().any() else values.cat.categories.dtype)
+        if _shareable(values.dtype):
+            columns[column] = values
+    return pd.DataFrame(columns, index=data.index)
+
+
+def _column_views(buffer, layout):
+    return [
+        np.ndarray(layout["n_rows"], dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        for _, dtype, offset in layout["columns"]
+    ]
+
+
+def frame_from_buffer(buffer, layout):
+    """View a shared memory block written by ``share_frame`` as a DataFrame.
+
+    Args:
+        buffer (memoryview): Buffer of the shared memory block.
+        layout (dict): Layout returned by ``share_frame``.
+
+    Returns:
+        pandas.DataFrame: The data, backed by the shared memory block.
+
+    """
+    names = [column for column, _, _ in layout["columns"]]
+    return pd.DataFrame(dict(zip(names, _column_views(buffer, layout))), copy=False)
+
+
+def _attach(name, layout):
+    global _shm, _data
+    _shm = shared_memory.SharedMemory(name=name)
+    _data = frame_from_buffer(_shm.buf, layout)
+
+
+def _subgroup(data, conditions):
+    mask = np.ones(len(data), dtype=bool)
+    for variable, value in conditions.items():
+        mask &= data[variable].to_numpy() == value
+    return data[mask]
+
+
+def _run_job(function, conditions):
+    return function(_subgroup(_data, conditions))
+
+
+def run_subgroup_jobs(data, jobs, max_workers=None):
+    """Run independent estimations on subgroups of the data in a process pool.
+
+    The data is copied once into shared memory, from which every worker reads it; only
+    the estimator and the subgroup definition are sent with a job. Only numeric, boolean
+    and numeric categorical columns (as their values) are passed to the estimators, in
+    a process pool as well as in the current process; string columns such as
+    ``package`` cannot be shared.
+
+    Args:
+        data (pandas.DataFrame): Data. Columns of other dtypes are left out.
+        jobs (dict): Maps job names to tuples of an estimator (a module-level function
+            taking a DataFrame) and a subgroup definition (a dict of variable-value
+            pairs, empty for all observations).
+        max_workers (int, optional): Number of processes. Defaults to the number of
+            cores. With 1, the jobs run in the current process.
+
+    Returns:
+        dict: Maps job names to the estimators' results.
+
+    """
+    if not jobs:
+        return {}
+    data = _numeric_frame(data)
+    if max_workers == 1:
+        return {name: function(_subgroup(data, conditions)) for name, (function, conditions) in jobs.items()}
+
+    max_workers = min(max_workers or os.cpu_count(), len(jobs))
+    shm, layout = share_frame(data)
+    try:
+        with ProcessPoolExecutor(max_workers, initializer=_attach, initargs=(shm.name, layout)) as pool:
+            futures = {name: pool.submit(_run_job, function, conditions) for name, (function, conditions) in jobs.items()}
+            return {name: future.result() for name, future in futures.items()}
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,123 @@
+"""Randomization inference for differences between subgroups of respondents."""
+import numpy as np
+import pandas as pd
+from statsmodels.stats.multitest import multipletests
+
+from analysis.bootstrap import ols_cluster_statistics
+from analysis.registry import explanatory_variables
+
+ADJUSTMENTS = ["holm", "fdr_bh"]
+
+
+def permuted_labels(labels, n_permutations, rng):
+    """Shuffle respondent-level group labels.
+
+    Args:
+        labels (numpy.ndarray): Group label of every respondent.
+        n_permutations (int): Number of permutations.
+        rng (numpy.random.Generator): Random number generator.
+
+    Returns:
+        numpy.ndarray: (n_permutations x n_respondents) matrix of shuffled labels.
+
+    """
+    return rng.permuted(np.tile(labels, (n_permutations, 1)), axis=1)
+
+
+def _permutation_test(statistic, labels, n_permutations, seed, chunk_size):
+    """Two-sided permutation p-values of a vectorized difference statistic.
+
+    ``statistic`` maps a (k x n_respondents) matrix of 0/1 labels to the (k x n)
+    differences between the groups, so chunks of permutations are evaluated at once.
+    """
+    observed = statistic(labels[None, :])[0]
+    rng = np.random.default_rng(seed)
+    exceed = np.zeros(observed.shape)
+    for start in range(0, n_permutations, chunk_size):
+        Z = permuted_labels(labels, min(chunk_size, n_permutations - start), rng)
+        exceed += (np.abs(statistic(Z)) >= np.abs(observed) - 1e-12).sum(axis=0)
+    return observed, (exceed + 1) / (n_permutations + 1)
+
+
+def _test_table(index, observed, p_values):
+    table = pd.DataFrame({"difference": observed, "p_value": p_values}, index=index)
+    tested = ~np.isnan(observed)
+    for method in ADJUSTMENTS:
+        table[f"p_{method}"] = np.nan
+        table.loc[tested, f"p_{method}"] = multipletests(p_values[tested], method=method)[1]
+    return table
+
+
+def permutation_test_marginal_means(cube, group, n_permutations=2000, seed=0, chunk_size=500):
+    """Permutation test of the differences in marginal means between two subgroups.
+
+    The respondent-level group label is shuffled across respondents; for every
+    permutation, the marginal means of both groups are ratios of label-weighted sums of
+    the per-respondent statistics, so a chunk of permutations takes two matrix products.
+
+    Args:
+        cube (MarginalMeansCube): Cube returned by ``marginal_means_cube``, holding
+            ``group`` among its covariates.
+        group (str): Binary respondent-level variable defining the subgroups.
+        n_permutations (int): Number of permutations.
+        seed (int): Seed of the random number generator.
+        chunk_size (int): Number of permutations evaluated at once.
+
+    Returns:
+        pandas.DataFrame: For every ``{level}_MM``, the difference between the marginal
+            means of group 1 and group 0, its permutation p-value and the p-values
+            adjusted for testing all levels (Holm and Benjamini-Hochberg).
+
+    """
+    labels = cube.covariates[group].to_numpy(dtype=np.float64)
+    total_rows, total_support = cube.level_rows.sum(axis=0), cube.level_support.sum(axis=0)
+
+    def statistic(Z):
+        rows, support = Z @ cube.level_rows, Z @ cube.level_support
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return support / rows - (total_support - support) / (total_rows - rows)
+
+    observed, p_values = _permutation_test(statistic, labels, n_permutations, seed, chunk_size)
+    return _test_table([f"{att_level}_MM" for att_level in cube.levels], observed, p_values)
+
+
+def permutation_test_amce(data, group, registry, model="model3c", n_permutations=2000, seed=0, chunk_size=200):
+    """Permutation test of the differences in AMCE between two subgroups.
+
+    For every permutation, the linear probability model of both groups is solved from
+    label-weighted sums of the per-respondent cross products, as in the bootstrap.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        group (str): Binary respondent-level variable defining the subgroups.
+        registry (dict): The model registry.
+        model (str): Name of the model in the registry.
+        n_permutations (int): Number of permutations.
+        seed (int): Seed of the random number generator.
+        chunk_size (int): Number of permutations evaluated at once.
+
+    Returns:
+        pandas.DataFrame: For every attribute level, the difference in AMCE between
+            group 1 and group 0, its permutation p-value and the p-values adjusted for
+            testing all levels (Holm and Benjamini-Hochberg). Controls are not tested.
+
+    """
+    explanatory_vars = explanatory_variables(data.columns, model, registry)
+    gram, xy = ols_cluster_statistics(data, explanatory_vars)
+    # Same respondent order as the cluster statistics (order of first appearance)
+    labels = data.groupby("ID", sort=False)[group].first().to_numpy(dtype=np.float64)
+    p = xy.shape[1]
+    levels = [j for j, name in enumerate(["const"] + explanatory_vars) if name.startswith("att")]
+    gram = gram.reshape(-1, p * p)
+    total_gram, total_xy = gram.sum(axis=0), xy.sum(axis=0)
+
+    def solve(gram_z, xy_z):
+        bread = np.linalg.pinv(gram_z.reshape(-1, p, p), rcond=1e-10, hermitian=True)
+        return np.einsum("bij,bj->bi", bread, xy_z)
+
+    def statistic(Z):
+        gram_1, xy_1 = Z @ gram, Z @ xy
+        return (solve(gram_1, xy_1) - solve(total_gram - gram_1, total_xy - xy_1))[:, levels]
+
+    observed, p_values = _permutation_test(statistic, labels, n_permutations, seed, chunk_size)
+    return _test_table([x for x in explanatory_vars if x.startswith("att")], observed, p_values)
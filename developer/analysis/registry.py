@@ -0,0 +1,161 @@
+"""Registry of the regression models and planning of their estimation."""
+from collections import namedtuple
+from functools import partial
+from pathlib import Path
+
+from analysis.cache import result_key, subgroup_hash
+from analysis.estimation import ESTIMATOR_VERSION, fit_ols_batch
+from analysis.parallel import run_subgroup_jobs
+from utilities import read_yaml
+
+REGISTRY_PATH = Path(__file__).parent / "models.yaml"
+
+FitGroup = namedtuple("FitGroup", ["outcome", "subgroup", "specifications", "aliases"])
+FitGroup.__doc__ = """Models estimated together on the same rows.
+
+Attributes:
+    outcome (str): Name of the outcome.
+    subgroup (dict): Subgroup definition as variable-value pairs.
+    specifications (dict): Maps the name of every distinct specification to its
+        explanatory variables.
+    aliases (dict): Maps every model name to the name of the specification it shares.
+
+"""
+
+
+def load_registry(path=REGISTRY_PATH):
+    """Load the model registry.
+
+    Args:
+        path (str or pathlib.Path): Path to the registry.
+
+    Returns:
+        dict: The registry.
+
+    """
+    return read_yaml(path)
+
+
+def explanatory_variables(columns, name, registry):
+    """Explanatory variables of a registered model, leaving out the reference levels.
+
+    Args:
+        columns (list): Columns of the regression data.
+        name (str): Name of the model.
+        registry (dict): The model registry.
+
+    Returns:
+        list: Names of the explanatory variables.
+
+    """
+    spec = registry["models"][name]
+    explanatory_vars = [col for col in columns if any(att in col for att in spec["attributes"])]
+    controls = spec.get("controls", False)
+    explanatory_vars += registry["controls"] if controls is True else list(controls or [])
+    return [x for x in explanatory_vars if x not in registry["reference_levels"]]
+
+
+def plan_fits(registry, columns, names=None):
+    """Group the registered models by the rows they are estimated on.
+
+    Models with the same outcome and subgroup are fitted together from one design matrix
+    (their regressors are subsets of it), and models with the same explanatory variables
+    are fitted only once.
+
+    Args:
+        registry (dict): The model registry.
+        columns (list): Columns of the regression data.
+        names (list, optional): Models to plan. Defaults to all registered models.
+
+    Returns:
+        list: The ``FitGroup`` of every distinct outcome and subgroup.
+
+    """
+    groups = {}
+    for name in registry["models"] if names is None else names:
+        spec = registry["models"][name]
+        outcome = spec.get("outcome", registry["outcome"])
+        subgroup = spec.get("subgroup") or {}
+        group = groups.setdefault(
+            (outcome, tuple(sorted(subgroup.items()))), FitGroup(outcome, subgroup, {}, {})
+        )
+
+        explanatory_vars = explanatory_variables(columns, name, registry)
+        shared = next((s for s, v in group.specifications.items() if v == explanatory_vars), None)
+        if shared is None:
+            group.specifications[name] = explanatory_vars
+        group.aliases[name] = shared or name
+
+    return list(groups.values())
+
+
+def model_key(data, name, registry, groups="ID"):
+    """Cache key of a registered model.
+
+    The key depends on the estimator version, the resolved specification and the values
+    of the columns the model uses on the rows of its subgroup, so editing a subgroup
+    definition or a column only invalidates the models using it.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        name (str): Name of the model.
+        registry (dict): The model registry.
+        groups (str or list): Cluster variable(s).
+
+    Returns:
+        str: The key.
+
+    """
+    spec = registry["models"][name]
+    outcome = spec.get("outcome", registry["outcome"])
+    subgroup = spec.get("subgroup") or {}
+    explanatory_vars = explanatory_variables(data.columns, name, registry)
+    cluster_vars = [groups] if isinstance(groups, str) else list(groups)
+    data_hash = subgroup_hash(data, [outcome] + explanatory_vars + cluster_vars, subgroup)
+    return result_key("ols", ESTIMATOR_VERSION, outcome, explanatory_vars, sorted(subgroup.items()), cluster_vars, data_hash)
+
+
+def fit_registry(data, registry, names=None, groups="ID", max_workers=None, cache=None):
+    """Fit the registered models as planned by ``plan_fits``.
+
+    Every fit group is one job of ``run_subgroup_jobs``, so groups on different
+    subgroups run in parallel and models within a group share their design matrix.
+    With a cache, models whose inputs did not change are read from it and only the
+    others are planned and fitted.
+
+    Args:
+        data (pandas.DataFrame): Regression data.
+        registry (dict): The model registry.
+        names (list, optional): Models to fit. Defaults to all registered models.
+        groups (str or list): Cluster variable(s), see ``fit_ols_batch``.
+        max_workers (int, optional): Number of processes, see ``run_subgroup_jobs``.
+        cache (analysis.cache.ResultCache, optional): Cache of estimates.
+
+    Returns:
+        dict: Maps model names to their ``Estimates``.
+
+    """
+    names = list(registry["models"]) if names is None else names
+    estimates, keys = {}, {}
+    if cache is not None:
+        for name in names:
+            keys[name] = model_key(data, name, registry, groups)
+            cached = cache.get(keys[name])
+            if cached is not None:
+                estimates[name] = cached
+
+    missing = [name for name in names if name not in estimates]
+    if missing:
+        plan = plan_fits(registry, data.columns, missing)
+        jobs = {
+            i: (partial(fit_ols_batch, specifications=group.specifications, outcome=group.outcome, groups=groups), group.subgroup)
+            for i, group in enumerate(plan)
+        }
+        results = run_subgroup_jobs(data, jobs, max_workers)
+        for i, group in enumerate(plan):
+            for name, shared in group.aliases.items():
+                estimates[name] = results[i][shared]
+                if cache is not None:
+                    cache.put(keys[name], estimates[name])
+
+    return {name: estimates[name] for name in names}
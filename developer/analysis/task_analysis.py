@@ -6,120 +6,226 @@ sys.path = list(set(sys.path))
 import pandas as pd
 import pytask
 
-from analysis.model import fit_model_1, fit_model_1_c, fit_model_2, fit_model_2_c, fit_model_3, fit_model_3_c, marginal_means
-from config import OUT
+from analysis.cache import ResultCache
+from analysis.choice import fit_conditional_logits
+from analysis.model import marginal_means_cube, subgroup_marginal_means
+from analysis.interactions import fit_interactions
+from analysis.latent import fit_latent_classes, latent_class_tables
+from analysis.ordinal import fit_ordered_registry
+from analysis.bootstrap import bootstrap_amce, bootstrap_intervals, bootstrap_marginal_means
+from analysis.permutation import permutation_test_amce, permutation_test_marginal_means
+from analysis.registry import explanatory_variables, fit_registry, load_registry
+from config import BOOTSTRAP_REPLICATES, BOOTSTRAP_SEED, CODE, LATENT_CLASSES, LATENT_RESTARTS, LATENT_SEED, N_WORKERS, OUT, PERMUTATIONS, PERMUTATION_SEED, RESULT_CACHE, RESULT_CACHE_MAX_BYTES, TABLE_FORMAT
+from utilities import read_table, write_table
+
+REGRESSION_COLUMNS = ['support', 'ageFilter', 'genderFilter', 'treatment_status', 'trust_ID', 'coal_prox', 'coal_state', 'high_income', 'aware', 'chosen', 'utility']
+
+# Respondent-level binary variables splitting the sample into subgroups
+SPLITS = ['treatment_status', 'trust_ID', 'coal_prox', 'coal_state', 'high_income', 'aware']
+
+# Subgroups for the marginal means
+MM_SUBGROUPS = {
+    'model_MM': {},
+    'model_control': {'treatment_status': 0},
+    'model_treated': {'treatment_status': 1},
+    'model_low_trust': {'trust_ID': 0},
+    'model_high_trust': {'trust_ID': 1},
+    'model_non_coal_prox': {'coal_prox': 0},
+    'model_coal_prox': {'coal_prox': 1},
+    'model_non_coal_state': {'coal_state': 0},
+    'model_coal_state': {'coal_state': 1},
+    'model_low_income': {'high_income': 0},
+    'model_high_income': {'high_income': 1},
+    'model_not_aware': {'aware': 0},
+    'model_aware': {'aware': 1},
+}
+
+# Registered models also estimated as conditional logits of the forced choice
+CHOICE_MODELS = ['model1', 'model2', 'model3', 'model_amce_high_trust', 'model_amce_low_trust', 'model_amce_aware', 'model_amce_not_aware', 'model_amce_coal_state', 'model_amce_non_coal']
+
+# Registered models also estimated as ordered probits of the 7-point utility rating
+ORDINAL_MODELS = ['model3c', 'model_amce_high_trust', 'model_amce_low_trust', 'model_amce_aware', 'model_amce_not_aware', 'model_amce_coal_state', 'model_amce_non_coal']
+
+def _read_regression_data(path):
+    """Read the attribute, district and analysis columns of the regression data, with
+    ID, round and package as columns."""
+    return read_table(
+        path,
+        columns=lambda column: column.startswith(('att_', 'district_')) or column in REGRESSION_COLUMNS,
+        index_col=['ID', 'round', 'package'],
+    ).reset_index()
 
 @pytask.mark.depends_on(
         {
-            "data": OUT / "data" / "data_regression.csv",
+            "data": OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+            "models": CODE / "analysis" / "models.yaml",
         }
     )
 @pytask.mark.produces(
         {
-        'model1' : OUT / "models" / "model1.pickle",
-        'model1c' : OUT / "models" / "model1c.pickle",
-        'model2' : OUT / "models" / "model2.pickle",
-        'model2c' : OUT / "models" / "model2c.pickle",
-        'model3' : OUT / "models" / "model3.pickle",
-        'model3c' : OUT / "models" / "model3c.pickle",
-        'model_amce_high_trust': OUT / "models" / "model_amce_high_trust.pickle",
-        'model_amce_low_trust' : OUT / "models" / "model_amce_low_trust.pickle",
-        'model_amce_aware' : OUT / "models" / "model_amce_aware.pickle",
-        'model_amce_not_aware' : OUT / "models" / "model_amce_not_aware.pickle",
-        'model_amce_coal_state' : OUT / "models" / "model_amce_coal_state.pickle",
-        'model_amce_non_coal' : OUT / "models" / "model_amce_non_coal.pickle",
-        'model_MM' : OUT / "models" / "data_MM.csv",
-        'model_control' : OUT / "models" / "model_control.csv",
-        'model_treated' : OUT / "models" / "model_treated.csv",
-        'model_low_trust' : OUT / "models" / "model_low_trust.csv",
-        'model_high_trust' : OUT / "models" / "model_high_trust.csv",
-        'model_non_coal_prox' : OUT / "models" / "model_non_coal_prox.csv",
-        'model_coal_prox' : OUT / "models" / "model_coal_prox.csv",
-        'model_non_coal_state' : OUT / "models" / "model_non_coal_state.csv",
-        'model_coal_state' : OUT / "models" / "model_coal_state.csv",
-        'model_low_income' : OUT / "models" / "model_low_income.csv",
-        'model_high_income' :OUT / "models" / "model_high_income.csv", 
-        'model_not_aware' : OUT / "models" / "model_not_aware.csv",
-        'model_aware' :OUT / "models" / "model_aware.csv",
+        **{name: OUT / "models" / f"{name}.npz" for name in load_registry()["models"]},
+        'model_MM' : OUT / "models" / f"data_MM.{TABLE_FORMAT}",
+        'model_control' : OUT / "models" / f"model_control.{TABLE_FORMAT}",
+        'model_treated' : OUT / "models" / f"model_treated.{TABLE_FORMAT}",
+        'model_low_trust' : OUT / "models" / f"model_low_trust.{TABLE_FORMAT}",
+        'model_high_trust' : OUT / "models" / f"model_high_trust.{TABLE_FORMAT}",
+        'model_non_coal_prox' : OUT / "models" / f"model_non_coal_prox.{TABLE_FORMAT}",
+        'model_coal_prox' : OUT / "models" / f"model_coal_prox.{TABLE_FORMAT}",
+        'model_non_coal_state' : OUT / "models" / f"model_non_coal_state.{TABLE_FORMAT}",
+        'model_coal_state' : OUT / "models" / f"model_coal_state.{TABLE_FORMAT}",
+        'model_low_income' : OUT / "models" / f"model_low_income.{TABLE_FORMAT}",
+        'model_high_income' :OUT / "models" / f"model_high_income.{TABLE_FORMAT}", 
+        'model_not_aware' : OUT / "models" / f"model_not_aware.{TABLE_FORMAT}",
+        'model_aware' :OUT / "models" / f"model_aware.{TABLE_FORMAT}",
         }
     )
 def task_fit_model_python(depends_on, produces):
     
-    data = pd.read_csv(depends_on["data"])
-    data_control = data[data['treatment_status']==0]
-    data_treated = data[data['treatment_status']==1]
-    data_low_trust = data[data['trust_ID']==0]
-    data_high_trust = data[data['trust_ID']==1]
-    data_non_coal_prox = data[data['coal_prox'] == 0]
-    data_coal_prox = data[data['coal_prox'] == 1]
-    data_non_coal_state = data[data['coal_state'] == 0]
-    data_coal_state = data[data['coal_state'] == 1]
-    data_low_income = data[data['high_income'] == 0]
-    data_high_income = data[data['high_income'] == 1]
-    data_not_aware = data[data['aware'] == 0]
-    data_aware = data[data['aware'] == 1]
-
-    # Fit regressions
-    model1 = fit_model_1(data)
-    model1c = fit_model_1_c(data)
-    model2 = fit_model_2(data)
-    model2c = fit_model_2_c(data)
-    model3 = fit_model_3(data)
-    model3c = fit_model_3_c(data)
-
-    # fit AMCE on Trust and Awareness
-    model_amce_high_trust = fit_model_3_c(data_high_trust)
-    model_amce_low_trust = fit_model_3_c(data_low_trust)
-
-    model_amce_aware = fit_model_3_c(data_aware)
-    model_amce_not_aware = fit_model_3_c(data_not_aware)
-
-    model_amce_coal_state = fit_model_3_c(data_coal_state)
-    model_amce_non_coal = fit_model_3_c(data_non_coal_state)
-
-    # Marginal Means
-    model_MM = marginal_means(data)
-    model_control = marginal_means(data_control)
-    model_treated = marginal_means(data_treated)
-    model_low_trust = marginal_means(data_low_trust)
-    model_high_trust = marginal_means(data_high_trust)
-    model_non_coal_prox = marginal_means(data_non_coal_prox)
-    model_coal_prox = marginal_means(data_coal_prox)
-    model_non_coal_state = marginal_means(data_non_coal_state)
-    model_coal_state = marginal_means(data_coal_state)
-    model_low_income = marginal_means(data_low_income)
-    model_high_income = marginal_means(data_high_income)
-    model_not_aware = marginal_means(data_not_aware)
-    model_aware = marginal_means(data_aware)
-
-    model1.save(produces['model1'])
-    model1c.save(produces['model1c'])
-    model2.save(produces['model2'])
-    model2c.save(produces['model2c'])
-    model3.save(produces['model3'])
-    model3c.save(produces['model3c'])
-
-    model_amce_aware.save(produces['model_amce_aware'])
-    model_amce_not_aware.save(produces['model_amce_not_aware'])
-    model_amce_high_trust.save(produces['model_amce_high_trust'])
-    model_amce_low_trust.save(produces['model_amce_low_trust'])
-    model_amce_coal_state.save(produces['model_amce_coal_state'])
-    model_amce_non_coal.save(produces['model_amce_non_coal'])
-    
-    model_MM.to_csv(produces["model_MM"])
-    model_control.to_csv(produces['model_control'])
-    model_treated.to_csv(produces['model_treated'])
-    model_low_trust.to_csv(produces['model_low_trust'])
-    model_high_trust.to_csv(produces['model_high_trust'])
-    model_non_coal_prox.to_csv(produces['model_non_coal_prox'])
-    model_coal_prox.to_csv(produces['model_coal_prox'])
-    model_non_coal_state.to_csv(produces['model_non_coal_state'])
-    model_coal_state.to_csv(produces['model_coal_state'])
-    model_low_income.to_csv(produces['model_low_income'])
-    model_high_income.to_csv(produces['model_high_income'])
-    model_not_aware.to_csv(produces['model_not_aware'])
-    model_aware.to_csv(produces['model_aware'])
+    data = _read_regression_data(depends_on["data"])
+
+    cache = ResultCache(RESULT_CACHE, RESULT_CACHE_MAX_BYTES)
+
+    # Fit all registered regressions, models on the same rows together
+    models = fit_registry(data, load_registry(depends_on["models"]), max_workers=N_WORKERS, cache=cache)
+
+    # Marginal Means, all subgroups from one aggregation
+    marginal_means = subgroup_marginal_means(data, MM_SUBGROUPS, cache)
+
+    for name, model in models.items():
+        model.save(produces[name])
+
+    for name, table in marginal_means.items():
+        write_table(table, produces[name])
+
+
+@pytask.mark.depends_on(
+        {
+            "data": OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+            "models": CODE / "analysis" / "models.yaml",
+        }
+    )
+@pytask.mark.produces({name: OUT / "models" / f"clogit_{name}.npz" for name in CHOICE_MODELS})
+def task_fit_choice_model_python(depends_on, produces):
+
+    data = _read_regression_data(depends_on["data"])
+
+    # Conditional logits of the forced choice, every model warm-started from the previous one
+    models = fit_conditional_logits(data, CHOICE_MODELS, load_registry(depends_on["models"]))
+
+    for name, model in models.items():
+        model.save(produces[name])
+
+
+@pytask.mark.depends_on(
+        {
+            "data": OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+            "models": CODE / "analysis" / "models.yaml",
+        }
+    )
+@pytask.mark.produces({name: OUT / "models" / f"oprobit_{name}.npz" for name in ORDINAL_MODELS})
+def task_fit_ordinal_model_python(depends_on, produces):
+
+    data = _read_regression_data(depends_on["data"])
+
+    # Ordered probits of the utility rating, one job per subgroup
+    models = fit_ordered_registry(data, load_registry(depends_on["models"]), ORDINAL_MODELS, max_workers=N_WORKERS)
+
+    for name, model in models.items():
+        model.save(produces[name])
+
+
+@pytask.mark.depends_on(
+        {
+            "data": OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+            "models": CODE / "analysis" / "models.yaml",
+        }
+    )
+@pytask.mark.produces(OUT / "models" / f"interactions_acie.{TABLE_FORMAT}")
+def task_fit_interactions_python(depends_on, produces):
+
+    data = _read_regression_data(depends_on["data"])
 
+    # ACIE of all pairs of attributes, with the controls of model 3C
+    acie = fit_interactions(data, load_registry(depends_on["models"]), controls=True)
+
+    write_table(acie, produces)
+
+
+@pytask.mark.depends_on(
+        {
+            "data": OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+            "models": CODE / "analysis" / "models.yaml",
+        }
+    )
+@pytask.mark.produces(
+        {
+        **{f'MM_class_{c}': OUT / "models" / f"latent_class_{c}_MM.{TABLE_FORMAT}" for c in range(1, LATENT_CLASSES + 1)},
+        **{f'amce_class_{c}': OUT / "models" / f"latent_class_{c}_amce.npz" for c in range(1, LATENT_CLASSES + 1)},
+        'params' : OUT / "models" / f"latent_class_params.{TABLE_FORMAT}",
+        }
+    )
+def task_fit_latent_classes_python(depends_on, produces):
+
+    data = _read_regression_data(depends_on["data"])
+
+    # Segment the respondents by their ratings of the model 3 attributes
+    registry = load_registry(depends_on["models"])
+    explanatory_vars = explanatory_variables(data.columns, 'model3', registry)
+    classes = fit_latent_classes(data, explanatory_vars, LATENT_CLASSES, n_restarts=LATENT_RESTARTS, seed=LATENT_SEED, max_workers=N_WORKERS)
+    marginal_means, amce = latent_class_tables(data, classes, registry, 'model3c')
+
+    for name in classes.shares.index:
+        write_table(marginal_means[name], produces[f'MM_{name}'])
+        amce[name].save(produces[f'amce_{name}'])
+    write_table(pd.concat([classes.params, classes.shares.to_frame('share').T]), produces['params'])
+
+
+@pytask.mark.depends_on(
+        {
+            "data": OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+            "models": CODE / "analysis" / "models.yaml",
+        }
+    )
+@pytask.mark.produces(
+        {
+        'amce' : OUT / "models" / f"bootstrap_amce.{TABLE_FORMAT}",
+        'MM' : OUT / "models" / f"bootstrap_MM.{TABLE_FORMAT}",
+        }
+    )
+def task_bootstrap_python(depends_on, produces):
+
+    data = _read_regression_data(depends_on["data"])
+
+    # Bootstrap intervals of model 3C and the marginal means
+    registry = load_registry(depends_on["models"])
+    replicates_amce = bootstrap_amce(data, registry, 'model3c', BOOTSTRAP_REPLICATES, BOOTSTRAP_SEED, max_workers=N_WORKERS)
+    replicates_MM = bootstrap_marginal_means(data, BOOTSTRAP_REPLICATES, BOOTSTRAP_SEED, max_workers=N_WORKERS)
+
+    write_table(bootstrap_intervals(replicates_amce), produces['amce'])
+    write_table(bootstrap_intervals(replicates_MM), produces['MM'])
+
+
+@pytask.mark.depends_on(
+        {
+            "data": OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+            "models": CODE / "analysis" / "models.yaml",
+        }
+    )
+@pytask.mark.produces(
+        {
+        'amce' : OUT / "models" / f"permutation_amce.{TABLE_FORMAT}",
+        'MM' : OUT / "models" / f"permutation_MM.{TABLE_FORMAT}",
+        }
+    )
+def task_permutation_tests_python(depends_on, produces):
 
+    data = _read_regression_data(depends_on["data"])
 
+    # Differences between the subgroups of every split
+    cube = marginal_means_cube(data, SPLITS)
+    tests_MM = {split: permutation_test_marginal_means(cube, split, PERMUTATIONS, PERMUTATION_SEED) for split in SPLITS}
+    registry = load_registry(depends_on["models"])
+    tests_amce = {split: permutation_test_amce(data, split, registry, 'model3c', PERMUTATIONS, PERMUTATION_SEED) for split in SPLITS}
 
+    write_table(pd.concat(tests_amce, names=['split', 'level']), produces['amce'])
+    write_table(pd.concat(tests_MM, names=['split', 'level']), produces['MM'])
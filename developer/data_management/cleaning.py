@@ -1,15 +1,20 @@
 """Function(s) for cleaning the data set(s)."""
 import pandas as pd
 import numpy as np
-import math
+import re
 
-def clean_data(df, specs, renaming_specs):
+from data_management.spatial import any_site_within
+
+def clean_data(df, specs, renaming_specs, site_index, header_rows=(0, 1), first_id=1):
     """Cleans and preprocesses the input DataFrame according to provided specifications.
 
     Parameters:
         df (pandas.DataFrame): The input DataFrame containing raw data to be cleaned.
         specs (dict): A dictionary containing specifications for data cleaning and preprocessing.
         renaming_specs (dict): A dictionary containing specifications for renaming attribute and utility names.
+        site_index (scipy.spatial.cKDTree): Index of the coal sites used for the proximity indicator.
+        header_rows (tuple): Labels of the Qualtrics header rows to drop.
+        first_id (int): ID given to the first respondent in df.
 
     Returns:
         pandas.DataFrame: A cleaned and preprocessed DataFrame following the specified operations.
@@ -18,33 +23,18 @@ def clean_data(df, specs, renaming_specs):
         _inconsistency: An internal function used to compute the inconsistency indicator.
 
     """
-    df = df.drop([0, 1])
+    df = df.drop(list(header_rows))
     df['LocationLatitude'] = df['LocationLatitude'].astype(float)
     df['LocationLongitude'] = df['LocationLongitude'].astype(float)
-    df = coal_prox_indicator(df)
+    df = coal_prox_indicator(df, site_index, specs['coal_prox']['radius'])
     
-    df = df.replace(renaming_specs['utility'])
-    df = df.replace(renaming_specs['treatment'])
-    df = df.replace(renaming_specs['trust'])
-    df['genderFilter'] = df['genderFilter'] .replace(renaming_specs['gender'])
-    df = df.replace(renaming_specs['policy_overview'])
+    df = recode(df, compile_recoding(df.columns, renaming_specs))
 
-    df['district'] = df['district'].replace(renaming_specs['district'])
     df['state'] = df['district_2']
 
     # geolocation relevant
     df['coal_state'] = df['state'].replace(renaming_specs['coal_state'])
 
-    for category in list(renaming_specs['attributes'].keys()):
-        if category == 'soc_distributive':
-            columns_to_replace = df.filter(like='att_2').columns
-            
-            # Replace values in selected columns
-            df[columns_to_replace] = df[columns_to_replace].replace(renaming_specs['attributes'][category])
-
-        else:    
-            df = df.replace(renaming_specs['attributes'][category])
-
     # Keep Variables
     variable_specs = specs["variables"]
     groups_of_vars = variable_specs.keys()
@@ -66,11 +56,11 @@ def clean_data(df, specs, renaming_specs):
             continue
 
     
-    df['ID'] = range(1, len(df) + 1)
+    df['ID'] = range(first_id, first_id + len(df))
     #df = df.set_index("ID")
 
     # Add group indicators
-    df = _inconsistency(df)
+    df = _inconsistency(df, specs['rounds'])
     df = _trust_ID(df)
     df = _coal_state(df)
     df = _high_income(df)
@@ -78,6 +68,62 @@ def clean_data(df, specs, renaming_specs):
 
     return df
 
+def compile_recoding(columns, renaming_specs):
+    """Compiles the value mappings in renaming_specs into a column-scoped recoding plan.
+
+    The ``recoding`` entry of renaming_specs gives, for every mapping, a regular
+    expression selecting the columns it applies to. Mappings that target the same
+    column are merged, so that every column is recoded exactly once.
+
+    Parameters:
+        columns (list): Columns of the DataFrame to be recoded.
+        renaming_specs (dict): A dictionary containing specifications for renaming attribute and utility names.
+
+    Returns:
+        dict: Maps every column to be recoded to its value mapping.
+
+    """
+    scopes = dict(renaming_specs['recoding'])
+    attribute_scopes = scopes.pop('attributes')
+
+    mappings = [(pattern, renaming_specs[name]) for name, pattern in scopes.items()]
+    mappings += [(pattern, renaming_specs['attributes'][category]) for category, pattern in attribute_scopes.items()]
+
+    plan = {}
+    for pattern, mapping in mappings:
+        for column in pd.Index(columns)[pd.Index(columns).str.match(pattern)]:
+            plan.setdefault(column, {}).update(mapping)
+
+    return plan
+
+def recode(df, plan):
+    """Recodes the columns of df according to a recoding plan.
+
+    Every column is factorized and only its distinct values are looked up in the
+    mapping, values without a mapping are kept as they are.
+
+    Parameters:
+        df (pandas.DataFrame): The DataFrame to be recoded.
+        plan (dict): Recoding plan as returned by ``compile_recoding``.
+
+    Returns:
+        pandas.DataFrame: The recoded DataFrame.
+
+    """
+    df = df.copy()
+    for column, mapping in plan.items():
+        df[column] = _recode_column(df[column], mapping)
+
+    return df
+
+def _recode_column(column, mapping):
+    codes, uniques = pd.factorize(column)
+    # NaN keys (`.nan` in the YAML file) never compare equal, look them up separately
+    na_value = next((value for key, value in mapping.items() if isinstance(key, float) and np.isnan(key)), np.nan)
+    lookup = np.array([mapping.get(value, value) for value in uniques] + [na_value], dtype=object)
+
+    return pd.Series(lookup[codes], index=column.index, name=column.name).infer_objects()
+
 ### GROUP IDS:
 def _trust_ID(df):
     df['trust_average'] = df[['trust_in_governement_1', 'trust_in_governement_2', 'trust_in_governement_3']].astype(int).mean(axis=1)
@@ -85,10 +131,10 @@ def _trust_ID(df):
 
     return df
 
-def _inconsistency(df):
+def _inconsistency(df, n_rounds):
     """Looks for inconsistency between preferred package and  choices and likert rating"""
     
-    for round in range(1,7):
+    for round in range(1, n_rounds + 1):
         df[f'likert_choice_{round}_A'] = df[f'likert_{round}_1'] >= df[f'likert_{round}_2']
         df[f'likert_choice_{round}_B'] = df[f'likert_{round}_1'] <= df[f'likert_{round}_2']
     
@@ -110,7 +156,47 @@ def _awareness(df):
     df['aware'] = df['aware'].astype(int)
     return df
 
-def make_long(df, renaming_specs):
+RESPONDENT_COLUMNS = [
+    'ID',
+    'treatment_status',
+    'trust_in_governement_1',
+    'trust_in_governement_2',
+    'trust_in_governement_3',
+    'trust_average',
+    'trust_ID',
+    'coal_prox',
+    'coal_state',
+    'high_income',
+    'aware',
+    'genderFilter',
+    'ageFilter',
+    'district',
+]
+
+def _round_columns(renaming_specs):
+    """Templates of the round-specific columns and their names in the long format."""
+    templates = [f'round_{{round}}_att_{att}_{package}' for att in range(1, 6) for package in ['a', 'b']]
+    round_columns = dict(zip(templates, renaming_specs["new_names"]))
+    round_columns.update({
+        'choice_set_{round}' : 'choice',
+        'likert_{round}_1' : 'utility_A',
+        'likert_{round}_2' : 'utility_B',
+        'inconsistency_{round}' : 'inconsistent',
+    })
+    return round_columns
+
+def _stack_rounds(block):
+    """Interleaves the per-round columns of block into one column, respondent by respondent."""
+    dtypes = block.dtypes
+    if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+        categories = dtypes.iloc[0].categories
+        if all(dtype.categories.equals(categories) for dtype in dtypes):
+            codes = np.column_stack([block[column].cat.codes.to_numpy() for column in block.columns])
+            return pd.Categorical.from_codes(codes.ravel(), categories)
+
+    return pd.Series(block.to_numpy().ravel()).infer_objects()
+
+def make_long(df, renaming_specs, n_rounds):
     """Transforms the wide-format survey daya into a long-format DataFrame with repeated measures.
 
     This function takes the wide format from the raw survey data, where each row represents a participant
@@ -118,273 +204,274 @@ def make_long(df, renaming_specs):
     It converts the DataFrame into a long format, with each row representing an individual choice round, 
     associated with the participant and the round.
 
+    All rounds are stacked at once: respondent-level columns are repeated ``n_rounds`` times and
+    the ``n_rounds`` columns of every round-specific variable are interleaved into one column.
+
     Parameters:
         df (pandas.DataFrame): The input DataFrame in wide format with participant data and multiple rounds.
+        renaming_specs (dict): A dictionary containing specifications for renaming attribute and utility names.
+        n_rounds (int): Number of choice rounds per participant.
 
     Returns:
         pandas.DataFrame: A long-format DataFrame.
 
     """
-    long_df = pd.DataFrame()
-    for round in range(1,7):
-        df_temp = df[['ID',
-                      'treatment_status',
-                      'trust_in_governement_1',
-                      'trust_in_governement_2',
-                      'trust_in_governement_3',
-                      'trust_average',
-                      'trust_ID',
-                      'coal_prox',
-                      'coal_state',
-                      'high_income',
-                      'aware',
-                      'genderFilter',
-                      'ageFilter',
-                      'district',
-                      f'round_{round}_att_1_a', 
-                      f'round_{round}_att_1_b',
-                      f'round_{round}_att_2_a', 
-                      f'round_{round}_att_2_b', 
-                      f'round_{round}_att_3_a', 
-                      f'round_{round}_att_3_b', 
-                      f'round_{round}_att_4_a', 
-                      f'round_{round}_att_4_b', 
-                      f'round_{round}_att_5_a', 
-                      f'round_{round}_att_5_b', 
-                      f'choice_set_{round}', 
-                      f'likert_{round}_1', 
-                      f'likert_{round}_2',
-                      f'inconsistency_{round}']].copy()
-        df_temp['round'] = round
-        df_temp = df_temp.rename(columns={
-            f'round_{round}_att_1_a' : renaming_specs["new_names"][0], 
-            f'round_{round}_att_1_b' : renaming_specs["new_names"][1],
-            f'round_{round}_att_2_a' : renaming_specs["new_names"][2], 
-            f'round_{round}_att_2_b' : renaming_specs["new_names"][3], 
-            f'round_{round}_att_3_a' : renaming_specs["new_names"][4], 
-            f'round_{round}_att_3_b' : renaming_specs["new_names"][5], 
-            f'round_{round}_att_4_a' : renaming_specs["new_names"][6], 
-            f'round_{round}_att_4_b' : renaming_specs["new_names"][7], 
-            f'round_{round}_att_5_a' : renaming_specs["new_names"][8], 
-            f'round_{round}_att_5_b' : renaming_specs["new_names"][9], 
-            f'choice_set_{round}' : 'choice', 
-            f'likert_{round}_1' : 'utility_A',
-            f'likert_{round}_2' : 'utility_B',
-            f'inconsistency_{round}' :  'inconsistent'
-        })
-        long_df = pd.concat([long_df, df_temp])
-
-    first_columns = ['ID', 'round']
-    all_cols = long_df.columns
-
-    new_order = first_columns + [c for c in all_cols if c not in first_columns]
-
-    long_df = long_df[new_order]
+    rounds = range(1, n_rounds + 1)
+    rows = np.repeat(np.arange(len(df)), n_rounds)
+
+    long_df = df[RESPONDENT_COLUMNS].iloc[rows].reset_index(drop=True)
+    long_df.insert(1, 'round', np.tile(np.arange(1, n_rounds + 1), len(df)))
+
+    for template, name in _round_columns(renaming_specs).items():
+        long_df[name] = _stack_rounds(df[[template.format(round=round) for round in rounds]])
+
     long_df = long_df.set_index(['ID', 'round'])
-    long_df = long_df.sort_index()
+    if not long_df.index.is_monotonic_increasing:
+        long_df = long_df.sort_index()
     
     return long_df
 
 def make_dummy(df, renaming_specs):
     # Create dummy variables for each attribute level
-    attribute_cols = renaming_specs['new_names']
-    attribute_cols.append('district')
+    attribute_cols = renaming_specs['new_names'] + ['district']
     df_with_dummies = pd.get_dummies(df, columns=attribute_cols)
 
     return df_with_dummies
 
 def make_ready_for_regression(df_with_dummies, renaming_specs):
-    vars_to_keep = renaming_specs['keep']
-    A_columns = [c for c in list(df_with_dummies.columns) if "_A" in c] + vars_to_keep
-    B_columns = [c for c in list(df_with_dummies.columns) if "_B" in c] + vars_to_keep
-    new_columns = [col.replace( '_A', '') for col in A_columns]
-
-    df_A = df_with_dummies[A_columns].copy()
-    df_A.columns = new_columns
-    df_A["package"] = "A"
-    df_B = df_with_dummies[B_columns].copy()
-    df_B.columns = new_columns
-    df_B["package"] = "B"
-    total = pd.concat([df_A, df_B])
-    
-    total = total.reset_index()
-    total = total.set_index(['ID', 'round', 'package'])
+    total = stack_packages(df_with_dummies, renaming_specs, renaming_specs['keep'])
 
     total = _set_support_dummy(total)
+    total = _set_chosen_dummy(total)
     total = standardize(total, 'utility')
 
     return total
 
 def make_long_descriptive(df, renaming_specs):
-    vars_to_keep = renaming_specs['keep_descriptive']
-    df = df.copy()
-    A_columns = [c for c in list(df.columns) if "_A" in c] + vars_to_keep
-    B_columns = [c for c in list(df.columns) if "_A" in c] + vars_to_keep
-    new_columns = [col.replace( '_A', '') for col in A_columns]
-
-    df_A = df[A_columns].copy()
-    df_A.columns = new_columns
-    df_A["package"] = "A"
-    df_B = df[B_columns].copy()
-    df_B.columns = new_columns
-    df_B["package"] = "B"
-    df = pd.concat([df_A, df_B])
-
-    df = df.reset_index()
-    df = df.set_index(['ID', 'round', 'package'])
+    df = stack_packages(df, renaming_specs, renaming_specs['keep_descriptive'])
 
     df = _set_support_dummy(df)
 
     return df
 
+def stack_packages(df, renaming_specs, vars_to_keep):
+    """Stacks the two packages (A and B) of every choice round into separate rows.
+
+    Package columns are the attributes in renaming_specs["new_names"] (or their dummies,
+    e.g. ``att_1_A_Reduce2030``) and the utility rating, matched by their exact ``_A``/``_B``
+    suffix; a column present for only one package is zero for the other. Every stacked column is built with a single allocation, respondent-level
+    columns in vars_to_keep are gathered once for both packages.
+
+    Parameters:
+        df (pandas.DataFrame): Long-format DataFrame indexed by ID and round.
+        renaming_specs (dict): A dictionary containing specifications for renaming attribute and utility names.
+        vars_to_keep (list): Respondent-level columns to carry over.
+
+    Returns:
+        pandas.DataFrame: DataFrame indexed by ID, round and package, with all A rows first.
+
+    """
+    prefixes = [name[:-2] for name in renaming_specs['new_names'] if name.endswith('_A')] + ['utility']
+
+    # Levels shown in only one of the packages get zeros in the other one
+    package_columns = {}
+    for package in ['A', 'B']:
+        for column in df.columns:
+            for prefix in prefixes:
+                if column == f'{prefix}_{package}' or column.startswith(f'{prefix}_{package}_'):
+                    rest = column[len(prefix) + 2:]
+                    package_columns.setdefault(prefix + rest, (f'{prefix}_A{rest}', f'{prefix}_B{rest}'))
+
+    n = len(df)
+    stacked = {}
+    for name, columns in package_columns.items():
+        present = next(column for column in columns if column in df.columns)
+        values_A, values_B = (
+            df[column] if column in df.columns else pd.Series(np.zeros(n, dtype=df[present].dtype), index=df.index)
+            for column in columns
+        )
+        stacked[name] = pd.concat([values_A, values_B], ignore_index=True)
+
+    both = np.tile(np.arange(n), 2)
+    stacked = pd.DataFrame(stacked)
+    kept = df[vars_to_keep].iloc[both].reset_index(drop=True)
+
+    index = df.index.to_frame(index=False).iloc[both].reset_index(drop=True)
+    index['package'] = np.repeat(['A', 'B'], n)
+
+    total = pd.concat([stacked, kept], axis=1)
+    total.index = pd.MultiIndex.from_frame(index)
+
+    return total
+
 def _set_support_dummy(df):
     df['support'] = df['utility'] >= 5
     df['unsupport'] = df['utility'] <= 3
     return df
 
+def _set_chosen_dummy(df):
+    """Marks the package chosen in the forced choice ('None of them' marks neither)."""
+    df['chosen'] = df['choice'].to_numpy() == df.index.get_level_values('package')
+    return df.drop(columns='choice')
+
+def level_codes(conjoint_reg):
+    """Integer codes of the attribute levels shown in every profile.
+
+    Parameters:
+        conjoint_reg (pandas.DataFrame): Regression data with attribute level dummies.
+
+    Returns:
+        tuple: Array of shape (n_profiles, n_attributes) with the position of every
+            profile's level in the list of levels (-1 if no level is set), and the list
+            of level dummy names, ordered by attribute.
+
+    """
+    levels = [c for c in conjoint_reg.columns if re.match(r'^att_\d+_', c)]
+    attributes = pd.Index([_attribute(level) for level in levels])
+
+    codes = np.empty((len(conjoint_reg), attributes.nunique()), dtype=np.int64)
+    for j, attribute in enumerate(attributes.unique()):
+        positions = np.flatnonzero(attributes == attribute)
+        block = conjoint_reg[[levels[p] for p in positions]].to_numpy(dtype=bool)
+        codes[:, j] = np.where(block.any(axis=1), positions[block.argmax(axis=1)], -1)
+
+    return codes, levels
+
+def _attribute(level):
+    return re.match(r'^(att_\d+)_', level).group(1)
+
+def _slice_values(df, name):
+    return df[name] if name in df.columns else df.index.get_level_values(name)
+
+def level_counts(conjoint_reg, by=None, codes=None):
+    """Number of profiles showing each attribute level, overall or by slice.
+
+    All levels (and slices) are counted in a single ``np.bincount`` over the integer
+    coded levels.
+
+    Parameters:
+        conjoint_reg (pandas.DataFrame): Regression data with attribute level dummies.
+        by (str or list, optional): Column(s) or index level(s) defining the slices,
+            e.g. ``'round'``, ``'package'`` or ``'trust_ID'``.
+        codes (tuple, optional): Result of ``level_codes`` to reuse across calls.
+
+    Returns:
+        pandas.Series or pandas.DataFrame: Counts indexed by the level dummy names, or
+            a DataFrame with one row per slice if by is given.
+
+    """
+    codes, levels = level_codes(conjoint_reg) if codes is None else codes
+    n_levels = len(levels)
+
+    if by is None:
+        slices, n_slices = np.zeros(len(conjoint_reg), dtype=np.int64), 1
+    else:
+        by = [by] if isinstance(by, str) else list(by)
+        keys = [_slice_values(conjoint_reg, name) for name in by]
+        slices, uniques = pd.MultiIndex.from_arrays(keys, names=by).factorize(sort=True) if len(by) > 1 else pd.factorize(keys[0], sort=True)
+        n_slices = len(uniques)
+
+    keys = slices[:, None] * n_levels + codes
+    counts = np.bincount(keys[codes >= 0], minlength=n_slices * n_levels).reshape(n_slices, n_levels)
+
+    if by is None:
+        return pd.Series(counts[0], index=levels)
+    index = uniques if len(by) > 1 else pd.Index(uniques, name=by[0])
+    return pd.DataFrame(counts, index=index, columns=levels)
+
 def frequencies(conjoint_reg):
-    frequency_table =  {}
-    groups = ['att_1', 'att_2','att_3', 'att_4', 'att_5']
-    for group in groups:
-        total = sum(dict(conjoint_reg.filter(like=group).sum()).values())
-        frequency_table[group] = {key.replace(f'{group}_', '') : (value / total).round(2) for key, value in dict(conjoint_reg.filter(like=group).sum()).items()}
-    frequency_table = pd.DataFrame(frequency_table).sum(axis=1)
-    frequency_table = pd.DataFrame(frequency_table, columns=["frequency"])
+    return frequency_table(level_counts(conjoint_reg))
+
+def frequency_table(level_counts):
+    """Share of every attribute level among the levels of its attribute.
+
+    Parameters:
+        level_counts (pandas.Series or pandas.DataFrame): Number of profiles showing
+            each attribute level, indexed by the dummy column names (e.g.
+            ``att_1_Reduce2030``), or a DataFrame of such counts with one row per slice.
+
+    Returns:
+        pandas.DataFrame: The frequency table, with one column per slice if level_counts
+            is a DataFrame.
+
+    """
+    counts = level_counts.to_frame("frequency") if isinstance(level_counts, pd.Series) else level_counts.T
+    attributes = [_attribute(level) for level in counts.index]
+
+    table = (counts / counts.groupby(attributes).transform('sum')).round(2)
+    table.index = [level[len(attribute) + 1:] for level, attribute in zip(counts.index, attributes)]
+
+    table = table.rename_axis("Attribute_level")
+    return table
 
-    frequency_table = frequency_table.rename_axis("Attribute_level")
-    return frequency_table
+def balance_counts(conjoint_reg, splits):
+    """Level counts for several splits of the regression data.
 
-def standardize(df, column):
-    df[f'{column}_standardized'] = (df[column] - df[column].mean()) / df[column].std()
+    The levels are coded once and reused for every split.
+
+    Parameters:
+        conjoint_reg (pandas.DataFrame): Regression data with attribute level dummies.
+        splits (list): Columns or index levels to split by.
+
+    Returns:
+        dict: Maps every split to its level counts, see ``level_counts``.
+
+    """
+    codes = level_codes(conjoint_reg)
+    return {split: level_counts(conjoint_reg, split, codes) for split in splits}
+
+def balance_table(counts):
+    """Frequency tables of several splits, e.g. to check the randomisation balance.
+
+    Parameters:
+        counts (dict): Level counts by split as returned by ``balance_counts``.
+
+    Returns:
+        pandas.DataFrame: Level shares with one column per split and slice.
+
+    """
+    tables = {}
+    for split, split_counts in counts.items():
+        table = frequency_table(split_counts)
+        # Slice values of different splits have different types (True == 1), store them as strings
+        table.columns = table.columns.astype(str)
+        tables[split] = table
+    return pd.concat(tables, axis=1, names=['split', 'value'])
+
+def standardize(df, column, mean=None, std=None):
+    """Adds the standardized version of a column.
+
+    Parameters:
+        df (pandas.DataFrame): The input DataFrame.
+        column (str): Column to standardize.
+        mean (float, optional): Mean to use instead of the sample mean of df, e.g. the
+            mean over all chunks of a streamed data set.
+        std (float, optional): Standard deviation to use instead of the sample one.
+
+    Returns:
+        pandas.DataFrame: The DataFrame with the standardized column.
+
+    """
+    mean = df[column].mean() if mean is None else mean
+    std = df[column].std() if std is None else std
+    df[f'{column}_standardized'] = (df[column] - mean) / std
 
     return df
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371000  # meters
-    rad1 = math.radians(lat1)  # φ, λ in radians φ1
-    rad2 = math.radians(lat2) #φ2
-    diff1 = math.radians(lat2 - lat1)
-    diff2 = math.radians(lon2 - lon1)
+def coal_prox_indicator(data_clean, site_index, radius=50):
+    """Flag respondents living less than ``radius`` km from a coal site.
 
-    a = math.sin(diff1/2) * math.sin(diff1/2) + \
-        math.cos(rad1) * math.cos(rad2) * \
-        math.sin(diff2/2) * math.sin(diff2/2)
-    
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-    d = R * c  # in meters
-
-    d = d / 1000
-    d = round(d, 2)
-    return d
-
-def coal_prox_indicator(data_clean):
-
-    #https://www.globaldata.com/data-insights/mining/india--five-largest-coal-mines-in-2090702/#:~:text=The%20five%20largest%20coal%20mines,mmtpa%20of%20ROM%20in%202021.
-    coal_mines = {
-        '1' : [27.287517, 95.751477],
-        '2' : [25.037752, 87.373761],
-        '3' : [24.548647, 87.443779],
-        '4' : [23.575851, 87.325296],
-        '5' : [23.445079, 87.143132],
-        '6' : [23.677697, 87.363157],
-        '7' : [23.682152, 87.146260],
-        '8' : [23.851652, 86.969975],
-        '9' : [23.807820, 86.732851],
-        '10' : [23.683085, 86.486627],
-        '11' : [23.771554, 86.412535],
-        '12' : [23.775896, 86.015363],
-        '13' : [23.771473, 85.877080],
-        '14' : [24.149130, 86.860477],
-        '15' : [24.114265, 86.306799],
-        '16' : [23.768901, 85.888556],
-        '17' : [23.604326, 85.699821],
-        '18' : [23.650260, 85.539991],
-        '19' : [23.796200, 85.596535],
-        '20' : [23.847373, 85.428889],
-        '21' : [23.872281, 85.540571],
-        '22' : [23.726677, 85.495022],
-        '23' : [23.656667, 85.381336],
-        '24' : [23.896400, 85.228915],
-        '25' : [23.715208, 85.049809],
-        '26' : [23.934183, 85.007813],
-        '27' : [23.649937, 84.595527],
-        '28' : [24.139321, 84.062995],
-        '29' : [20.939208, 85.151544],
-        '30' : [24.158834, 82.675149],
-        '31' : [23.909456, 82.263674],
-        '32' : [22.821391, 82.611755],
-        '33' : [22.839616, 82.889254],
-        '34' : [23.194206, 83.205632],
-        '35' : [23.426914, 83.342806],
-        '36' : [23.424925, 82.454474],
-        '37' : [23.280041, 81.806704],
-        '38' : [23.377800, 81.165452],
-        '39' : [23.525660, 80.646948],
-        '40' : [22.345591, 82.606193],
-        '41' : [22.247135, 83.016019],
-        '42' : [22.097075, 83.340930],
-        '43' : [21.771074, 83.878586],
-        '44' : [17.301741, 80.658494],
-        '45' : [17.221380, 80.154848],
-        '46' : [17.947081, 80.714797],
-        '47' : [17.568518, 80.349386],
-        '48' : [18.210918, 80.137139],
-        '49' : [18.496900, 79.770093],
-        '50' : [19.035322, 79.256833],
-        '51' : [19.231001, 79.351393],
-        '52' : [17.947966, 79.437091],
-        '53' : [19.811458, 79.307934],
-        '54' : [20.020555, 79.330957],
-        '55' : [19.908344, 79.269055],
-        '56' : [20.075125, 79.060184],
-        '57' : [19.965048, 79.092092],
-        '58' : [19.771579, 79.151852],
-        '59' : [20.177642, 78.809595],
-        '60' : [19.849756, 78.631139],
-        '61' : [21.243727, 79.194690],
-        '62' : [21.372038, 78.909259],
-        '63' : [21.959186, 79.331323],
-        '64' : [22.213886, 78.915332],
-        '65' : [22.176780, 78.743598],
-        '66' : [22.185255, 78.631074],
-        '67' : [22.131219, 78.157579],
-        '68' : [11.566912, 79.471791],
-        '69' : [21.423798, 73.170243],
-        '70' : [21.709576, 73.233760],
-        '71' : [21.730270, 72.201700],
-        '72' : [23.569893, 68.889212],
-        '73' : [23.716086, 68.780059],
-        '74' : [24.771589, 70.390926],
-        '75' : [25.549808, 71.140310],
-        '76' : [25.928480, 71.352955],
-        '77' : [27.052643, 74.045848],
-        '78' : [27.840332, 73.201115],
-        '79' : [27.531098, 72.510852],
-    }
-
-    #https://www.power-technology.com/features/feature-the-top-10-biggest-thermal-power-plants-in-india/?cf-view
-    coal_plants = {
-        'Mundra Thermal Power Station, Gujarat' : [22.824412, 69.547972],
-        'Mundra Ultra Mega Power Plant, Gujarat' : [22.815815, 69.525399],
-        'Sasan Ultra Mega Power Plant, Madhya Pradesh' : [23.983091, 82.618795],
-        'Tiroda Thermal Power Plant, Maharashtra' : [21.413246, 79.966920],
-        'Talcher Super Thermal Power Station, Odisha' : [21.096245, 85.073762],
-        'Rihand Thermal Power Station, Uttar Pradesh' : [24.027386, 82.790051],
-        'Sipat Thermal Power Plant, Chhattisgarh' : [22.136485, 82.289925],
-        'Chandrapur Super Thermal Power Station, Maharashtra' : [20.005170, 79.293512],
-        'NTPC Dadri, Uttar Pradesh' : [28.597505, 77.607886],
-    }
-
-    for name, coordinates in coal_mines.items():
-        data_clean[f'coal_mine_prox_{name}'] = data_clean.apply(lambda row: calculate_distance(row['LocationLatitude'], row['LocationLongitude'], coordinates[0], coordinates[1]), axis=1)
-
-    for name, coordinates in coal_plants.items():
-        data_clean[f'coal_plant_prox_{name}'] = data_clean.apply(lambda row: calculate_distance(row['LocationLatitude'], row['LocationLongitude'], coordinates[0], coordinates[1]), axis=1)
-
-    matching_columns = [col for col in data_clean.columns if col.startswith("coal_mine") or col.startswith("coal_plant")]
-
-    # Check if any value in the matching columns is smaller than 100
-    data_clean['coal_prox'] = data_clean[matching_columns].lt(50).any(axis=1).astype(int)
-
-    return data_clean
\ No newline at end of file
+    Args:
+        data_clean (pandas.DataFrame): Survey data with respondent coordinates.
+        site_index (scipy.spatial.cKDTree): Index of the coal sites, see
+            ``spatial.load_site_index``.
+        radius (float): Distance threshold in km.
+
+    Returns:
+        pandas.DataFrame: The data with the ``coal_prox`` indicator.
+
+    """
+    within = any_site_within(site_index, data_clean['LocationLatitude'], data_clean['LocationLongitude'], radius)
+    data_clean['coal_prox'] = within.astype(int)
+
+    return data_clean
@@ -0,0 +1,241 @@
+"""Incremental processing of appended survey waves."""
+import hashlib
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from data_management.cleaning import (
+    balance_counts,
+    balance_table,
+    clean_data,
+    frequency_table,
+    level_counts,
+    make_dummy,
+    make_long,
+    make_long_descriptive,
+    make_ready_for_regression,
+    standardize,
+)
+from data_management.streaming import set_levels
+from utilities import TableWriter, read_table, write_table
+
+INDEX = ["ID", "round", "package"]
+
+# Outputs holding one row per respondent, round or package, appended to on every refresh
+OUTPUTS = ["clean", "long", "regression"]
+
+
+def _config_hash(specs, renaming_specs, site_index):
+    config = repr([specs, renaming_specs]).encode()
+    return hashlib.sha256(config + np.ascontiguousarray(site_index.data).tobytes()).hexdigest()
+
+
+def _empty_state(config):
+    return {
+        "config": config,
+        "fingerprints": {},
+        "next_id": 1,
+        "utility": {"n": 0, "sum": 0.0, "sum_squares": 0.0},
+        "level_counts": {},
+        "balance_counts": {},
+        "outputs": {},
+    }
+
+
+def _output_stamps(produces):
+    return {name: Path(produces[name]).stat().st_mtime_ns for name in OUTPUTS}
+
+
+def _load_state(state_path, produces, config):
+    """Load the stored state, or start afresh if the configuration changed or the
+    outputs were written or removed since it was saved."""
+    state_path = Path(state_path)
+    if not state_path.exists() or not all(Path(produces[name]).exists() for name in OUTPUTS):
+        return _empty_state(config)
+    with open(state_path) as stream:
+        state = json.load(stream)
+    if state["config"] != config or state.get("outputs") != _output_stamps(produces):
+        return _empty_state(config)
+    return state
+
+
+def _utility_moments(state):
+    n, total, total_squares = (state["utility"][key] for key in ["n", "sum", "sum_squares"])
+    mean = total / n
+    return mean, np.sqrt((total_squares - n * mean**2) / (n - 1))
+
+
+def _update_aggregates(state, regression, splits, sign):
+    """Add (sign=1) or remove (sign=-1) the contribution of regression rows to the
+    running utility moments, attribute level counts and balance counts."""
+    utility = regression["utility"].to_numpy(dtype=float)
+    utility = utility[~np.isnan(utility)]  # missing ratings are skipped, as by pandas' mean and std
+    state["utility"]["n"] += sign * utility.size
+    state["utility"]["sum"] += sign * utility.sum()
+    state["utility"]["sum_squares"] += sign * (utility**2).sum()
+
+    counts = level_counts(regression)
+    for level, count in counts.items():
+        state["level_counts"][level] = state["level_counts"].get(level, 0) + sign * int(count)
+
+    for split, counts in balance_counts(regression, splits).items():
+        stored = state["balance_counts"].get(split)
+        if stored is not None:
+            counts = pd.DataFrame(**stored).rename_axis(split).add(sign * counts, fill_value=0)
+        counts = counts[counts.sum(axis=1) > 0].astype(int)
+        state["balance_counts"][split] = {
+            "index": counts.index.tolist(),
+            "columns": counts.columns.tolist(),
+            "data": counts.to_numpy().tolist(),
+        }
+
+
+def _drop_respondents(path, ids, index_col, chunksize=100_000):
+    """Rewrite a stored table without the rows of some respondents, chunk by chunk.
+
+    CSV rows are copied as text, Parquet rows as Arrow batches, so the kept rows are
+    not converted.
+
+    Returns:
+        pandas.DataFrame: The dropped rows.
+
+    """
+    path = Path(path)
+    temporary = path.with_name(f"{path.stem}.tmp{path.suffix}")
+    if path.suffix == ".csv":
+        text_ids, dropped = [str(id_) for id_ in ids], []
+        chunks = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize)
+        for i, chunk in enumerate(chunks):
+            outdated = chunk["ID"].isin(text_ids)
+            chunk[~outdated].to_csv(temporary, index=False, mode="w" if i == 0 else "a", header=i == 0)
+            dropped.append(chunk[outdated])
+        dropped = pd.read_csv(io.StringIO(pd.concat(dropped).to_csv(index=False)), index_col=index_col)
+    else:
+        source, dropped = pq.ParquetFile(path), []
+        with pq.ParquetWriter(temporary, source.schema_arrow) as writer:
+            for batch in source.iter_batches(batch_size=chunksize):
+                outdated = pc.is_in(batch["ID"], value_set=pa.array(ids, type=batch["ID"].type))
+                writer.write_batch(batch.filter(pc.invert(outdated)))
+                dropped.append(batch.filter(outdated))
+        dropped = pa.Table.from_batches(dropped, source.schema_arrow).to_pandas()
+    temporary.replace(path)
+    return dropped
+
+
+def read_regression(path, state_path, columns=None):
+    """Read the regression data written by ``clean_data_incremental``.
+
+    The stored rows hold the raw utility ratings only, as their standardized values
+    change with every wave. ``utility_standardized`` is added from the running moments
+    in the state file.
+
+    Args:
+        path (str or pathlib.Path): Path to the regression data.
+        state_path (str or pathlib.Path): Path to the JSON file holding the state.
+        columns (list or callable, optional): Columns to load, see ``read_table``. They
+            must include ``utility``.
+
+    Returns:
+        pandas.DataFrame: The regression data.
+
+    """
+    with open(state_path) as stream:
+        state = json.load(stream)
+    data = read_table(path, columns=columns, index_col=INDEX)
+    return standardize(data, "utility", *_utility_moments(state))
+
+
+def clean_data_incremental(path, produces, specs, renaming_specs, site_index, state_path):
+    """Update the data management outputs with new or changed respondents only.
+
+    Respondents are identified by their Qualtrics response ID and fingerprinted by a
+    hash of their raw answers. Only new or changed respondents run through cleaning,
+    reshaping and dummy creation, and their rows are appended to the stored outputs.
+    The rows of changed or removed respondents are first dropped from the outputs in a
+    pass that copies the other rows without processing them. The utility moments, the
+    attribute level counts and the balance counts are kept as running aggregates in
+    the state file, so the frequency tables are rebuilt without reading the stored
+    rows. As the standardized ratings change with every wave, the regression data holds
+    the raw ratings only; ``read_regression`` standardizes them when reading. Changing
+    the specifications or the coal sites starts a full rebuild.
+
+    Args:
+        path (str or pathlib.Path): Path to the raw export.
+        produces (dict): Paths of the ``clean``, ``long``, ``regression``, ``freq`` and
+            ``freq_balance`` outputs. The first three must be CSV or Parquet files.
+        specs (dict): Specifications for data cleaning and preprocessing.
+        renaming_specs (dict): Specifications for renaming attribute and utility names.
+        site_index (scipy.spatial.cKDTree): Index of the coal sites.
+        state_path (str or pathlib.Path): Path to the JSON file holding the state.
+
+    """
+    unsupported = sorted({Path(produces[name]).suffix for name in OUTPUTS} - set(TableWriter.SUFFIXES))
+    if unsupported:
+        raise ValueError(
+            f"The incremental mode cannot append to {', '.join(unsupported)} tables. Use CSV or "
+            "Parquet tables (TABLE_FORMAT) or disable it (incremental: enabled: false)."
+        )
+
+    state = _load_state(state_path, produces, _config_hash(specs, renaming_specs, site_index))
+    fingerprints = state["fingerprints"]
+    splits = specs["balance_splits"]
+
+    raw = pd.read_csv(path, encoding="utf8")
+    body = raw.drop([0, 1])
+    response_ids = body[specs["incremental"]["id_column"]].astype(str)
+    hashes = pd.util.hash_pandas_object(body, index=False).astype(str)
+
+    stored_hashes = response_ids.map(lambda rid: fingerprints.get(rid, [None, None])[1])
+    to_process = (stored_hashes != hashes).to_numpy()
+    removed = set(fingerprints) - set(response_ids)
+    changed = [rid for rid in response_ids[to_process] if rid in fingerprints]
+    outdated_ids = [fingerprints[rid][0] for rid in changed + sorted(removed)]
+
+    first_run = not fingerprints
+    if not first_run and not to_process.any() and not removed:
+        return
+
+    if outdated_ids:
+        _drop_respondents(produces["clean"], outdated_ids, index_col=0)
+        _drop_respondents(produces["long"], outdated_ids, index_col=INDEX)
+        outdated = _drop_respondents(produces["regression"], outdated_ids, index_col=INDEX)
+        _update_aggregates(state, outdated, splits, -1)
+
+    if to_process.any():
+        ids = [fingerprints[rid][0] if rid in fingerprints else None for rid in response_ids[to_process]]
+        for i, id_ in enumerate(ids):
+            if id_ is None:
+                ids[i] = state["next_id"]
+                state["next_id"] += 1
+
+        new_data = clean_data(body[to_process], specs, renaming_specs, site_index, header_rows=())
+        new_data["ID"] = ids
+        new_long = make_long(new_data, renaming_specs, specs["rounds"])
+        new_regression = make_dummy(set_levels(new_long, renaming_specs), renaming_specs)
+        new_regression = make_ready_for_regression(new_regression, renaming_specs)
+        new_regression = new_regression.drop(columns="utility_standardized")
+        new_long = make_long_descriptive(new_long, renaming_specs)
+        _update_aggregates(state, new_regression, splits, 1)
+
+        for name, new in [("clean", new_data), ("long", new_long), ("regression", new_regression)]:
+            with TableWriter(produces[name], append=not first_run) as writer:
+                writer.write(new)
+
+        for rid, id_, fingerprint in zip(response_ids[to_process], ids, hashes[to_process]):
+            fingerprints[rid] = [id_, fingerprint]
+    for rid in removed:
+        del fingerprints[rid]
+
+    balance = {split: pd.DataFrame(**counts).rename_axis(split) for split, counts in state["balance_counts"].items()}
+    write_table(frequency_table(pd.Series(state["level_counts"])), produces["freq"])
+    write_table(balance_table(balance), produces["freq_balance"])
+
+    state["outputs"] = _output_stamps(produces)
+    with open(state_path, "w") as stream:
+        json.dump(state, stream)
@@ -0,0 +1,205 @@
+"""Coal site registry and spatial index for respondent-to-site distance queries."""
+import hashlib
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6371  # km
+
+
+def _to_unit_vectors(lat, lon):
+    """Map latitude/longitude in degrees to points on the unit sphere."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def _km_to_chord(distance):
+    return 2 * np.sin(min(distance / (2 * EARTH_RADIUS), np.pi / 2))
+
+
+def haversine_distances(lat, lon, site_lat, site_lon, chunk_size=10_000):
+    """Great-circle distances between every respondent and every site.
+
+    The respondents x sites matrix is computed by broadcasting, ``chunk_size``
+    respondents at a time so that the temporaries stay small for large survey waves.
+    Use the site index instead when only the nearest site or the sites within a radius
+    are needed.
+
+    Args:
+        lat (array-like): Respondent latitudes in degrees.
+        lon (array-like): Respondent longitudes in degrees.
+        site_lat (array-like): Site latitudes in degrees.
+        site_lon (array-like): Site longitudes in degrees.
+        chunk_size (int): Number of respondents processed per block.
+
+    Returns:
+        numpy.ndarray: Distances in km, rounded to two decimals, of shape
+            (n_respondents, n_sites). Missing coordinates give NaN.
+
+    """
+    rad1 = np.radians(np.asarray(lat, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(lon, dtype=float))[:, None]
+    rad2 = np.radians(np.asarray(site_lat, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(site_lon, dtype=float))[None, :]
+    cos2 = np.cos(rad2)
+
+    distances = np.empty((rad1.shape[0], rad2.shape[1]))
+    for start in range(0, rad1.shape[0], chunk_size):
+        stop = start + chunk_size
+        a = (
+            np.sin((rad2 - rad1[start:stop]) / 2) ** 2
+            + np.cos(rad1[start:stop]) * cos2 * np.sin((lon2 - lon1[start:stop]) / 2) ** 2
+        )
+        distances[start:stop] = 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return np.round(distances, 2)
+
+
+def build_site_index(site_lat, site_lon):
+    """Build a spatial index over a set of sites.
+
+    The sites are stored as 3D points on the unit sphere in a KD-tree. Straight-line
+    (chord) distances between such points are monotone in the great-circle distance,
+    so nearest-neighbour and radius queries on the tree are exact on the sphere.
+
+    Args:
+        site_lat (array-like): Site latitudes in degrees.
+        site_lon (array-like): Site longitudes in degrees.
+
+    Returns:
+        scipy.spatial.cKDTree: The site index.
+
+    """
+    return cKDTree(_to_unit_vectors(site_lat, site_lon))
+
+
+def _query_points(lat, lon):
+    points = _to_unit_vectors(lat, lon)
+    valid = np.isfinite(points).all(axis=1)
+    return points[valid], valid
+
+
+def nearest_site_distance(index, lat, lon):
+    """Distance from every respondent to the closest site.
+
+    Args:
+        index (scipy.spatial.cKDTree): Index returned by ``build_site_index``.
+        lat (array-like): Respondent latitudes in degrees.
+        lon (array-like): Respondent longitudes in degrees.
+
+    Returns:
+        numpy.ndarray: Great-circle distances in km. Missing coordinates give NaN.
+
+    """
+    points, valid = _query_points(lat, lon)
+    distance = np.full(valid.shape[0], np.nan)
+    chord, _ = index.query(points, k=1)
+    distance[valid] = _chord_to_km(chord)
+    return distance
+
+
+def count_sites_within(index, lat, lon, radius):
+    """Number of sites within ``radius`` km of every respondent.
+
+    Args:
+        index (scipy.spatial.cKDTree): Index returned by ``build_site_index``.
+        lat (array-like): Respondent latitudes in degrees.
+        lon (array-like): Respondent longitudes in degrees.
+        radius (float): Search radius in km.
+
+    Returns:
+        numpy.ndarray: Site counts. Missing coordinates count zero sites.
+
+    """
+    points, valid = _query_points(lat, lon)
+    counts = np.zeros(valid.shape[0], dtype=int)
+    counts[valid] = index.query_ball_point(points, r=_km_to_chord(radius), return_length=True)
+    return counts
+
+
+def any_site_within(index, lat, lon, radius):
+    """Whether any site lies within ``radius`` km of every respondent.
+
+    Args:
+        index (scipy.spatial.cKDTree): Index returned by ``build_site_index``.
+        lat (array-like): Respondent latitudes in degrees.
+        lon (array-like): Respondent longitudes in degrees.
+        radius (float): Search radius in km.
+
+    Returns:
+        numpy.ndarray: Boolean indicator. Missing coordinates give False.
+
+    """
+    points, valid = _query_points(lat, lon)
+    within = np.zeros(valid.shape[0], dtype=bool)
+    chord, _ = index.query(points, k=1, distance_upper_bound=_km_to_chord(radius))
+    within[valid] = np.isfinite(chord)
+    return within
+
+
+def read_coal_sites(path, types=None, active_on=None):
+    """Read the coal site registry.
+
+    The registry is a CSV file with one row per site and the columns ``name``,
+    ``type``, ``latitude``, ``longitude``, ``capacity``, ``start`` and ``end``. The
+    last three may be left empty; an empty ``start`` or ``end`` leaves the date range
+    open on that side.
+
+    Args:
+        path (str or pathlib.Path): Path to the registry.
+        types (list, optional): Site types to keep, e.g. ``['mine', 'plant']``. All
+            types are kept if None.
+        active_on (str, optional): Keep only sites operating on this date, which
+            allows to separate operating from planned or retired sites. All sites
+            are kept if None.
+
+    Returns:
+        pandas.DataFrame: The selected sites.
+
+    """
+    sites = pd.read_csv(path, parse_dates=['start', 'end'])
+    if types is not None:
+        sites = sites[sites['type'].isin(types)]
+    if active_on is not None:
+        date = pd.Timestamp(active_on)
+        started = sites['start'].isna() | (sites['start'] <= date)
+        not_ended = sites['end'].isna() | (sites['end'] >= date)
+        sites = sites[started & not_ended]
+    return sites.reset_index(drop=True)
+
+
+def load_site_index(sites, cache_dir):
+    """Load the spatial index of a set of sites, building it only if necessary.
+
+    Indices are cached in ``cache_dir`` under a hash of the site coordinates, so every
+    site selection is built once and reused by later runs.
+
+    Args:
+        sites (pandas.DataFrame): Sites as returned by ``read_coal_sites``.
+        cache_dir (str or pathlib.Path): Directory holding the cached indices.
+
+    Returns:
+        scipy.spatial.cKDTree: The site index.
+
+    """
+    coordinates = np.ascontiguousarray(sites[['latitude', 'longitude']].to_numpy(dtype=float))
+    key = hashlib.sha256(coordinates.tobytes()).hexdigest()[:16]
+    path = Path(cache_dir) / f'site_index_{key}.pickle'
+
+    if path.exists():
+        with open(path, 'rb') as stream:
+            return pickle.load(stream)
+
+    index = build_site_index(coordinates[:, 0], coordinates[:, 1])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as stream:
+        pickle.dump(index, stream)
+    return index
@@ -0,0 +1,163 @@
+"""Chunked processing of the raw survey export."""
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_management.cleaning import (
+    balance_counts,
+    balance_table,
+    clean_data,
+    compile_recoding,
+    frequency_table,
+    level_counts,
+    make_dummy,
+    make_long,
+    make_long_descriptive,
+    make_ready_for_regression,
+    recode,
+    standardize,
+)
+from utilities import TableWriter, write_table
+
+
+def read_raw_chunks(path, chunksize, usecols=None):
+    """Read the raw Qualtrics export in chunks of respondents.
+
+    All columns are read as strings, as they are when the whole export is read at once
+    (the two Qualtrics header rows make every column textual), so that every chunk is
+    parsed the same way. The header rows are the first two rows of the first chunk,
+    which therefore needs at least three rows.
+
+    Args:
+        path (str or pathlib.Path): Path to the raw export.
+        chunksize (int): Number of rows per chunk, at least 3.
+        usecols (callable, optional): Selects the columns to read.
+
+    Returns:
+        pandas.io.parsers.TextFileReader: Iterator over the chunks.
+
+    """
+    if chunksize < 3:
+        raise ValueError(f"The chunksize must be at least 3 to hold the two Qualtrics header rows, got {chunksize}.")
+    return pd.read_csv(path, encoding="utf8", dtype=str, chunksize=chunksize, usecols=usecols)
+
+
+def utility_moments(path, renaming_specs, chunksize):
+    """Mean and standard deviation of the utility ratings over the whole raw export.
+
+    This is the reduction pass of the streaming mode; only the rating columns are read.
+    Missing ratings are skipped, as pandas' ``mean`` and ``std`` do in the in-memory
+    pipeline.
+
+    Args:
+        path (str or pathlib.Path): Path to the raw export.
+        renaming_specs (dict): Specifications for renaming attribute and utility names.
+        chunksize (int): Number of rows per chunk.
+
+    Returns:
+        tuple: Mean and (sample) standard deviation of the ratings.
+
+    """
+    pattern = re.compile(renaming_specs["recoding"]["utility"])
+    n, total, total_squares = 0, 0.0, 0.0
+    for i, chunk in enumerate(read_raw_chunks(path, chunksize, usecols=lambda c: bool(pattern.match(c)))):
+        if i == 0:
+            chunk = chunk.drop([0, 1])
+        ratings = recode(chunk, compile_recoding(chunk.columns, renaming_specs))
+        ratings = ratings.to_numpy(dtype=float).ravel()
+        ratings = ratings[~np.isnan(ratings)]
+        n += ratings.size
+        total += ratings.sum()
+        total_squares += (ratings**2).sum()
+
+    mean = total / n
+    std = np.sqrt((total_squares - n * mean**2) / (n - 1))
+    return mean, std
+
+
+def set_levels(data_long, renaming_specs):
+    """Give the attribute and district columns all their levels.
+
+    This way every chunk of respondents yields the same dummy columns.
+
+    Args:
+        data_long (pandas.DataFrame): Long-format data as returned by ``make_long``.
+        renaming_specs (dict): Specifications for renaming attribute and utility names.
+
+    Returns:
+        pandas.DataFrame: The data with categorical attribute and district columns.
+
+    """
+    data_long = data_long.copy()
+    for att, name in enumerate(renaming_specs["new_names"]):
+        category = list(renaming_specs["attributes"])[att // 2]
+        levels = sorted(set(renaming_specs["attributes"][category].values()))
+        data_long[name] = pd.Categorical(data_long[name], categories=levels)
+    data_long["district"] = pd.Categorical(
+        data_long["district"], categories=sorted(renaming_specs["district"].values())
+    )
+    return data_long
+
+
+def clean_data_streaming(path, produces, specs, renaming_specs, site_index, chunksize):
+    """Run the data management stage chunk by chunk and append the results to disk.
+
+    The utility ratings are standardized with the moments of the whole export and the
+    frequency tables are built from level counts summed over all chunks, so the outputs
+    contain the same rows and values as the in-memory pipeline. Rows of the regression
+    data are ordered by chunk. Outputs can be CSV or Parquet files.
+
+    Args:
+        path (str or pathlib.Path): Path to the raw export.
+        produces (dict): Paths of the ``clean``, ``long``, ``regression``, ``freq`` and
+            ``freq_balance`` outputs.
+        specs (dict): Specifications for data cleaning and preprocessing.
+        renaming_specs (dict): Specifications for renaming attribute and utility names.
+        site_index (scipy.spatial.cKDTree): Index of the coal sites.
+        chunksize (int): Number of respondents per chunk.
+
+    """
+    appended = {name: Path(produces[name]) for name in ["clean", "long", "regression"]}
+    unsupported = sorted({p.suffix for p in appended.values() if p.suffix not in TableWriter.SUFFIXES})
+    if unsupported:
+        raise ValueError(
+            f"The streaming mode cannot append to {', '.join(unsupported)} tables. Use CSV or "
+            "Parquet tables (TABLE_FORMAT) or disable streaming (streaming: chunksize: null)."
+        )
+
+    mean, std = utility_moments(path, renaming_specs, chunksize)
+
+    counts, split_counts = None, None
+    first_id = 1
+    writers = {name: TableWriter(p) for name, p in appended.items()}
+    for i, chunk in enumerate(read_raw_chunks(path, chunksize)):
+        header_rows = (0, 1) if i == 0 else ()
+        data = clean_data(chunk, specs, renaming_specs, site_index, header_rows, first_id)
+        first_id += len(data)
+        data_long = make_long(data, renaming_specs, specs["rounds"])
+
+        data_regression = make_dummy(set_levels(data_long, renaming_specs), renaming_specs)
+        data_regression = make_ready_for_regression(data_regression, renaming_specs)
+        data_regression = standardize(data_regression, "utility", mean, std)
+        data_long = make_long_descriptive(data_long, renaming_specs)
+
+        chunk_counts = level_counts(data_regression)
+        chunk_split_counts = balance_counts(data_regression, specs["balance_splits"])
+        if counts is None:
+            counts, split_counts = chunk_counts, chunk_split_counts
+        else:
+            counts = counts + chunk_counts
+            split_counts = {
+                split: split_counts[split].add(c, fill_value=0).astype(int) for split, c in chunk_split_counts.items()
+            }
+
+        writers["clean"].write(data)
+        writers["long"].write(data_long)
+        writers["regression"].write(data_regression)
+
+    for writer in writers.values():
+        writer.close()
+    write_table(frequency_table(counts), produces["freq"])
+    write_table(balance_table(split_counts), produces["freq_balance"])
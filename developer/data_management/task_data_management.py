@@ -6,32 +6,49 @@ sys.path = list(set(sys.path))
 import pandas as pd
 import pytask
 
-from config import OUT, CODE, IN, MOCK_DATA
-from data_management.cleaning import clean_data, make_long, make_dummy, make_ready_for_regression, frequencies, standardize, make_long_descriptive
-from utilities import read_yaml
+from config import OUT, CODE, IN, MOCK_DATA, TABLE_FORMAT
+from data_management.cleaning import clean_data, make_long, make_dummy, make_ready_for_regression, frequencies, standardize, make_long_descriptive, balance_counts, balance_table
+from data_management.spatial import read_coal_sites, load_site_index
+from data_management.streaming import clean_data_streaming
+from data_management.incremental import clean_data_incremental
+from utilities import read_yaml, write_table
 
 @pytask.mark.depends_on( 
     {
         "main_sample" : IN / "main_sample_final.csv",
         "specs": CODE / "data_management" / "specs.yaml",
         "renaming_replacing" : CODE / "data_management" / "renaming_replacing.yaml",
+        "coal_sites" : CODE / "data_management" / "coal_sites.csv",
     })
 @pytask.mark.produces( 
     {
-        "clean" : OUT / "data" / "data_clean.csv",
-        "long" : OUT / "data" / "data_long.csv",
-        "regression" : OUT / "data" / "data_regression.csv",
-        "freq" : OUT / "data" / "data_freq.csv",  
+        "clean" : OUT / "data" / f"data_clean.{TABLE_FORMAT}",
+        "long" : OUT / "data" / f"data_long.{TABLE_FORMAT}",
+        "regression" : OUT / "data" / f"data_regression.{TABLE_FORMAT}",
+        "freq" : OUT / "data" / f"data_freq.{TABLE_FORMAT}",
+        "freq_balance" : OUT / "data" / f"data_freq_balance.{TABLE_FORMAT}",  
     })  
 def task_clean_data_python(produces, depends_on): 
     """Clean the data"""
-    data = pd.read_csv(depends_on["main_sample"], encoding="utf8")
     specs = read_yaml(depends_on["specs"])
     renaming_specs = read_yaml(depends_on["renaming_replacing"])  
+    coal_sites = read_coal_sites(depends_on["coal_sites"], specs["coal_prox"]["types"], specs["coal_prox"]["active_on"])
+    site_index = load_site_index(coal_sites, OUT / "data" / "cache")
+
+    if specs["incremental"]["enabled"]:
+        clean_data_incremental(depends_on["main_sample"], produces, specs, renaming_specs, site_index, OUT / "data" / "incremental_state.json")
+        return
+
+    chunksize = specs["streaming"]["chunksize"]
+    if chunksize is not None:
+        clean_data_streaming(depends_on["main_sample"], produces, specs, renaming_specs, site_index, chunksize)
+        return
+
+    data = pd.read_csv(depends_on["main_sample"], encoding="utf8")
 
     # Cleaned data for inspection
-    data = clean_data(data, specs, renaming_specs)
-    data_long = make_long(data, renaming_specs)
+    data = clean_data(data, specs, renaming_specs, site_index)
+    data_long = make_long(data, renaming_specs, specs["rounds"])
 
     # Cleaned data for regression
     data_regression = make_dummy(data_long, renaming_specs)
@@ -40,10 +57,12 @@ def task_clean_data_python(produces, depends_on):
     data_long = make_long_descriptive(data_long, renaming_specs)
 
     data_freq = frequencies(data_regression)
+    data_freq_balance = balance_table(balance_counts(data_regression, specs["balance_splits"]))
     
-    data.to_csv(produces["clean"], index=True)
-    data_long.to_csv(produces["long"], index=True)
-    data_regression.to_csv(produces["regression"], index=True)
-    data_freq.to_csv(produces['freq'], index=True)  
+    write_table(data, produces["clean"])
+    write_table(data_long, produces["long"])
+    write_table(data_regression, produces["regression"])
+    write_table(data_freq, produces["freq"])
+    write_table(data_freq_balance, produces["freq_balance"])  
   
 
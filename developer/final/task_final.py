@@ -9,34 +9,34 @@ import plotly.io as pio
 
 from analysis.model import load_model
 from final.plot import attribute_support, plot_regression, plot_MM, plot_MM_group, plot_AMCE_group, spatial_justice_coal_state 
-from config import OUT, CODE
-from utilities import read_yaml
+from config import OUT, CODE, TABLE_FORMAT
+from utilities import read_yaml, read_table
 
 #Plots: 
 @pytask.mark.depends_on(
     {
         "data_info": CODE / "final" / "plot_specs.yaml",
-        "data_long" : OUT / "data" / "data_long.csv",
-        "data_MM" : OUT / "models" / "data_MM.csv",
-        "data": OUT / "models" / "model3c.pickle",
-        "model_amce_high_trust": OUT / "models" / "model_amce_high_trust.pickle",
-        "model_amce_low_trust" : OUT / "models" / "model_amce_low_trust.pickle",
-        "model_amce_aware" : OUT / "models" / "model_amce_aware.pickle",
-        "model_amce_not_aware" : OUT / "models" / "model_amce_not_aware.pickle",
-        "model_amce_coal_state" : OUT / "models" / "model_amce_coal_state.pickle",
-        "model_amce_non_coal" : OUT / "models" / "model_amce_non_coal.pickle",
-        "data_control" : OUT / "models" / "model_control.csv",
-        "data_treated" : OUT / "models" / "model_treated.csv",
-        "data_low_trust" : OUT / "models" / "model_low_trust.csv",
-        "data_high_trust" : OUT / "models" / "model_high_trust.csv",
-        "data_non_coal_prox" : OUT / "models" / "model_non_coal_prox.csv",
-        "data_coal_prox" : OUT / "models" / "model_coal_prox.csv",
-        "data_non_coal_state" : OUT / "models" / "model_non_coal_state.csv",
-        "data_coal_state" : OUT / "models" / "model_coal_state.csv",
-        "data_low_income" : OUT / "models" / "model_low_income.csv",
-        "data_high_income" :OUT / "models" / "model_high_income.csv",
-        "data_not_aware" : OUT / "models" / "model_not_aware.csv",
-        "data_aware" :OUT / "models" / "model_aware.csv",
+        "data_long" : OUT / "data" / f"data_long.{TABLE_FORMAT}",
+        "data_MM" : OUT / "models" / f"data_MM.{TABLE_FORMAT}",
+        "data": OUT / "models" / "model3c.npz",
+        "model_amce_high_trust": OUT / "models" / "model_amce_high_trust.npz",
+        "model_amce_low_trust" : OUT / "models" / "model_amce_low_trust.npz",
+        "model_amce_aware" : OUT / "models" / "model_amce_aware.npz",
+        "model_amce_not_aware" : OUT / "models" / "model_amce_not_aware.npz",
+        "model_amce_coal_state" : OUT / "models" / "model_amce_coal_state.npz",
+        "model_amce_non_coal" : OUT / "models" / "model_amce_non_coal.npz",
+        "data_control" : OUT / "models" / f"model_control.{TABLE_FORMAT}",
+        "data_treated" : OUT / "models" / f"model_treated.{TABLE_FORMAT}",
+        "data_low_trust" : OUT / "models" / f"model_low_trust.{TABLE_FORMAT}",
+        "data_high_trust" : OUT / "models" / f"model_high_trust.{TABLE_FORMAT}",
+        "data_non_coal_prox" : OUT / "models" / f"model_non_coal_prox.{TABLE_FORMAT}",
+        "data_coal_prox" : OUT / "models" / f"model_coal_prox.{TABLE_FORMAT}",
+        "data_non_coal_state" : OUT / "models" / f"model_non_coal_state.{TABLE_FORMAT}",
+        "data_coal_state" : OUT / "models" / f"model_coal_state.{TABLE_FORMAT}",
+        "data_low_income" : OUT / "models" / f"model_low_income.{TABLE_FORMAT}",
+        "data_high_income" :OUT / "models" / f"model_high_income.{TABLE_FORMAT}",
+        "data_not_aware" : OUT / "models" / f"model_not_aware.{TABLE_FORMAT}",
+        "data_aware" :OUT / "models" / f"model_aware.{TABLE_FORMAT}",
     }, 
     ) 
 @pytask.mark.produces(
@@ -60,7 +60,7 @@ from utilities import read_yaml
 def task_plot_relative_differences(depends_on, produces):   
    
     # Fig 1
-    data_clean = pd.read_csv(depends_on["data_long"])
+    data_clean = read_table(depends_on["data_long"], columns=["att_1", "support"], index_col=["ID", "round", "package"])
     fig = attribute_support(data_clean, "att_1")
     pio.write_image(fig, produces['support'],scale=4, width=700, height=350)
 
@@ -72,7 +72,7 @@ def task_plot_relative_differences(depends_on, produces):
     pio.write_image(fig, produces['reg_amce'], scale=4, width=550, height=800)  
 
     # Fig 3 (Paper) 
-    model = pd.read_csv(depends_on["data_MM"])
+    model = read_table(depends_on["data_MM"], index_col=0)
     fig = plot_MM(model, data_info)
     pio.write_image(fig, produces['MM'], scale=4, width=550, height=800) 
 
@@ -84,8 +84,8 @@ def task_plot_relative_differences(depends_on, produces):
     pio.write_image(fig, produces['coal_AMCE'], scale=4, width=550, height=800) 
 
     # Fig 4.2 (Paper):  
-    model_non_coal_state = pd.read_csv(depends_on["data_non_coal_state"])
-    model_coal_state = pd.read_csv(depends_on["data_coal_state"])
+    model_non_coal_state = read_table(depends_on["data_non_coal_state"], index_col=0)
+    model_coal_state = read_table(depends_on["data_coal_state"], index_col=0)
     fig = plot_MM_group(model_non_coal_state, model_coal_state, data_info, group1="NonCoalState", group2="CoalState", width=1.0, plot_title="Marginal Means by Coal State")
     fig.write_image(produces['coal_MM']) 
     pio.write_image(fig, produces['coal_MM'], scale=4, width=550, height=800) 
@@ -98,8 +98,8 @@ def task_plot_relative_differences(depends_on, produces):
     pio.write_image(fig, produces['trust_AMCE'], scale=4, width=550, height=800) 
 
     # Fig 5.2 (Paper):  
-    model_low_trust = pd.read_csv(depends_on["data_low_trust"])
-    model_high_trust = pd.read_csv(depends_on["data_high_trust"])
+    model_low_trust = read_table(depends_on["data_low_trust"], index_col=0)
+    model_high_trust = read_table(depends_on["data_high_trust"], index_col=0)
     fig = plot_MM_group(model_low_trust, model_high_trust, data_info, group1="LowTrust", group2="HighTrust", width=1.0, plot_title="Marginal Means by High trust / Low trust")
     fig.write_image(produces['trust_MM']) 
     pio.write_image(fig, produces['trust_MM'], scale=4, width=550, height=800) 
@@ -112,39 +112,39 @@ def task_plot_relative_differences(depends_on, produces):
     pio.write_image(fig, produces['awareness_AMCE'], scale=4, width=550, height=800) 
  
     # Fig 6.2 (Paper)
-    model_not_aware = pd.read_csv(depends_on["data_not_aware"])
-    model_aware = pd.read_csv(depends_on["data_aware"])
+    model_not_aware = read_table(depends_on["data_not_aware"], index_col=0)
+    model_aware = read_table(depends_on["data_aware"], index_col=0)
     fig = plot_MM_group(model_not_aware, model_aware, data_info, group1="Not Aware", group2="Aware", width=1.0, plot_title="Marginal Means by awareness")
     fig.write_image(produces['awareness_MM'])
     pio.write_image(fig, produces['awareness_MM'], scale=4, width=550, height=800) 
     
     # Grouped by: 
     # Treatment
-    model_control = pd.read_csv(depends_on["data_control"])
-    model_treated = pd.read_csv(depends_on["data_treated"])
+    model_control = read_table(depends_on["data_control"], index_col=0)
+    model_treated = read_table(depends_on["data_treated"], index_col=0)
     fig = plot_MM_group(model_control, model_treated, data_info, group1="Control", group2="Treatment", width=1.0)
     fig.write_image(produces['treatment'])
 
     # Coal prox
-    model_non_coal_prox = pd.read_csv(depends_on["data_non_coal_prox"])
-    model_coal_prox = pd.read_csv(depends_on["data_coal_prox"])
+    model_non_coal_prox = read_table(depends_on["data_non_coal_prox"], index_col=0)
+    model_coal_prox = read_table(depends_on["data_coal_prox"], index_col=0)
     fig = plot_MM_group(model_non_coal_prox, model_coal_prox, data_info, group1="MoreThan50km", group2="LessThan50km", width=1.0, plot_title="Marginal Means by living less or more than 50km from coal plant or mine")
     fig.write_image(produces['coal_prox'])
 
-    model_non_coal = pd.read_csv(depends_on["data_non_coal_state"])
-    model_coal = pd.read_csv(depends_on["data_coal_state"])
+    model_non_coal = read_table(depends_on["data_non_coal_state"], index_col=0)
+    model_coal = read_table(depends_on["data_coal_state"], index_col=0)
     fig = spatial_justice_coal_state(model_non_coal, model_coal, data_info, group1="NonCoal", group2="Coal", width=1.0, plot_title="Marginal Means, Spatial Justice")
     fig.write_image(produces['coal_state_spatial'])
 
     # Coal state
-    model_non_coal_state = pd.read_csv(depends_on["data_non_coal_state"])
-    model_coal_state = pd.read_csv(depends_on["data_coal_state"])
+    model_non_coal_state = read_table(depends_on["data_non_coal_state"], index_col=0)
+    model_coal_state = read_table(depends_on["data_coal_state"], index_col=0)
     fig = plot_MM_group(model_non_coal_state, model_coal_state, data_info, group1="Not Coal State", group2="Coal State", width=1.0, plot_title="Marginal Means by living in a coal state")
     fig.write_image(produces['coal_state'])
 
     # Income
-    model_low_income = pd.read_csv(depends_on["data_low_income"])
-    model_high_income = pd.read_csv(depends_on["data_high_income"])
+    model_low_income = read_table(depends_on["data_low_income"], index_col=0)
+    model_high_income = read_table(depends_on["data_high_income"], index_col=0)
     fig = plot_MM_group(model_low_income, model_high_income, data_info, group1="LowIncome", group2="HighIncome", width=1.0, plot_title="Marginal Means by income")
     fig.write_image(produces['income']) 
 
@@ -153,12 +153,12 @@ def task_plot_relative_differences(depends_on, produces):
 Store a table in LaTeX format with the estimation results (Python version)."""
 @pytask.mark.depends_on(
     {
-        'model1' : OUT / "models" / "model1.pickle",
-        'model1c' : OUT / "models" / "model1c.pickle",
-        'model2' : OUT / "models" / "model2.pickle",
-        'model2c' : OUT / "models" / "model2c.pickle",
-        'model3' : OUT / "models" / "model3.pickle",
-        'model3c' : OUT / "models" / "model3c.pickle",
+        'model1' : OUT / "models" / "model1.npz",
+        'model1c' : OUT / "models" / "model1c.npz",
+        'model2' : OUT / "models" / "model2.npz",
+        'model2c' : OUT / "models" / "model2c.npz",
+        'model3' : OUT / "models" / "model3.npz",
+        'model3c' : OUT / "models" / "model3c.npz",
     })
 @pytask.mark.produces(OUT / "tables" / "estimation_results.tex")
 def task_create_results_table_python(depends_on, produces):
@@ -1,4 +1,11 @@
 """Utilities used in various parts of the project."""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 import yaml
 
 
@@ -23,4 +30,169 @@ def read_yaml(path):
             raise ValueError(info) from error
     return out
 
-__all__ = ["read_yaml"]
\ No newline at end of file
+
+def write_table(df, path):
+    """Write a DataFrame in the format given by the file suffix.
+
+    CSV files store the values only. Parquet and Feather files also keep the dtypes
+    (categoricals, booleans) and the (multi-)index.
+
+    Args:
+        df (pandas.DataFrame): The table.
+        path (str or pathlib.Path): Path to file ending in .csv, .parquet or .feather.
+
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        df.to_csv(path, index=True)
+    elif path.suffix == ".parquet":
+        _arrow_compatible(df).to_parquet(path, index=True)
+    elif path.suffix == ".feather":
+        feather.write_feather(pa.Table.from_pandas(_arrow_compatible(df), preserve_index=True), path)
+    else:
+        raise ValueError(f"Unsupported table format: {path.suffix}")
+
+
+def _arrow_compatible(df):
+    """Cast object columns holding strings and other values to strings.
+
+    Arrow columns have a single type, so e.g. a string column partly filled with a
+    number cannot be stored as it is; CSV files hold the same text either way.
+
+    """
+    mixed = {}
+    for column in df.columns:
+        if df[column].dtype == object:
+            types = set(df[column].dropna().map(type))
+            if str in types and len(types) > 1:
+                mixed[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+    return df.assign(**mixed) if mixed else df
+
+
+def read_table(path, columns=None, index_col=None):
+    """Read a table written by ``write_table``.
+
+    Only the requested columns are loaded. Parquet and Feather files restore their
+    stored index; CSV files use ``index_col`` instead.
+
+    Args:
+        path (str or pathlib.Path): Path to file ending in .csv, .parquet or .feather.
+        columns (list or callable, optional): Columns to load, or a function selecting
+            columns by name. All columns are loaded if None.
+        index_col (int, str or list, optional): Index column(s) of CSV files.
+
+    Returns:
+        pandas.DataFrame: The table.
+
+    """
+    path = Path(path)
+    if callable(columns):
+        columns = [column for column in _table_columns(path) if columns(column)]
+
+    if path.suffix == ".csv":
+        usecols = None
+        if columns is not None:
+            index_cols = [] if index_col is None else np.atleast_1d(index_col).tolist()
+            usecols = lambda column: column in columns or column in index_cols
+        return pd.read_csv(path, usecols=usecols, index_col=index_col)
+    if path.suffix == ".parquet":
+        table = pq.read_pandas(path, columns=columns)
+        # Integer categoricals are stored as plain integers, restore them from the
+        # pandas metadata
+        categorical = [
+            column["name"] for column in table.schema.pandas_metadata["columns"] if column["pandas_type"] == "categorical"
+        ]
+        return table.to_pandas(categories=[c for c in categorical if c in table.column_names])
+    if path.suffix == ".feather":
+        if columns is not None:
+            columns = _feather_index_columns(path) + [c for c in columns if c not in _feather_index_columns(path)]
+        return feather.read_table(path, columns=columns).to_pandas()
+    raise ValueError(f"Unsupported table format: {path.suffix}")
+
+
+def _table_columns(path):
+    """Names of the stored columns, without the index of Parquet and Feather files."""
+    if path.suffix == ".csv":
+        return pd.read_csv(path, nrows=0).columns.tolist()
+    schema = _schema(path)
+    index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+    return [name for name in schema.names if name not in index_columns]
+
+
+def _feather_index_columns(path):
+    index_columns = (_schema(path).pandas_metadata or {}).get("index_columns", [])
+    return [column for column in index_columns if isinstance(column, str)]
+
+
+def _schema(path):
+    if path.suffix == ".parquet":
+        return pq.read_schema(path)
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).schema
+
+
+class TableWriter:
+    """Append DataFrames chunk by chunk to a CSV or Parquet file.
+
+    Feather files cannot be appended to (all batches of an Arrow IPC file share one
+    dictionary per categorical column); write them at once with ``write_table``.
+
+    Args:
+        path (str or pathlib.Path): Path to file ending in .csv or .parquet.
+        append (bool): Whether to append to an existing file instead of replacing it.
+            Rows are added to the end of a CSV file in place. A Parquet file cannot be
+            reopened, so its row groups are copied, without conversion, into a new file
+            that replaces it on ``close``.
+
+    """
+
+    SUFFIXES = (".csv", ".parquet")
+
+    def __init__(self, path, append=False):
+        self.path = Path(path)
+        if self.path.suffix not in self.SUFFIXES:
+            raise ValueError(f"Appending is not supported for {self.path.suffix} tables.")
+        self._append = append and self.path.exists()
+        self._first = True
+        self._columns = None
+        self._writer = None
+        self._temporary = None
+
+    def write(self, df):
+        """Append df to the file."""
+        if self.path.suffix == ".csv":
+            if self._columns is None:
+                stored = pd.read_csv(self.path, nrows=0).columns[df.index.nlevels:] if self._append else df.columns
+                self._columns = list(stored)
+            header = self._first and not self._append
+            df[self._columns].to_csv(self.path, index=True, mode="w" if header else "a", header=header)
+        else:
+            table = pa.Table.from_pandas(_arrow_compatible(df), preserve_index=True)
+            if self._writer is None:
+                if self._append:
+                    stored = pq.ParquetFile(self.path)
+                    self._temporary = self.path.with_name(f"{self.path.stem}.tmp{self.path.suffix}")
+                    self._writer = pq.ParquetWriter(self._temporary, stored.schema_arrow)
+                    for i in range(stored.num_row_groups):
+                        self._writer.write_table(stored.read_row_group(i))
+                else:
+                    self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table.select(self._writer.schema.names).cast(self._writer.schema))
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._temporary is not None:
+            self._temporary.replace(self.path)
+            self._temporary = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+__all__ = ["read_yaml", "read_table", "write_table", "TableWriter"]
@@ -0,0 +1,6 @@
+"""Make the project modules importable as the tasks import them."""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "developer"), str(ROOT)]
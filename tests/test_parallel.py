@@ -0,0 +1,46 @@
+"""Tests of the parallel subgroup estimation."""
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis.estimation import fit_ols_batch
+from analysis.parallel import run_subgroup_jobs
+
+
+@pytest.fixture()
+def data():
+    rng = np.random.default_rng(0)
+    n_respondents = 60
+    ids = np.repeat(np.arange(n_respondents), 12)
+    return pd.DataFrame(
+        {
+            "ID": ids,
+            "round": np.tile(np.repeat(np.arange(1, 7), 2), n_respondents),
+            "package": np.tile(["A", "B"], 6 * n_respondents),
+            "att_1_Reduce2030": rng.integers(0, 2, ids.size).astype(bool),
+            "trust_ID": np.repeat(rng.integers(0, 2, n_respondents), 12),
+            "genderFilter": pd.Categorical(np.repeat(rng.integers(0, 2, n_respondents), 12)),
+            "support": rng.integers(0, 2, ids.size).astype(bool),
+        }
+    )
+
+
+@pytest.mark.unit()
+def test_run_subgroup_jobs_in_pool_with_string_and_categorical_columns(data):
+    estimator = partial(fit_ols_batch, specifications={"m": ["att_1_Reduce2030", "genderFilter"]})
+    jobs = {"all": (estimator, {}), "high_trust": (estimator, {"trust_ID": 1})}
+
+    pooled = run_subgroup_jobs(data, jobs, max_workers=2)
+    serial = run_subgroup_jobs(data, jobs, max_workers=1)
+
+    for name in jobs:
+        pd.testing.assert_series_equal(pooled[name]["m"].params, serial[name]["m"].params)
+    assert pooled["high_trust"]["m"].nobs == (data["trust_ID"] == 1).sum()
+
+
+@pytest.mark.unit()
+@pytest.mark.parametrize("max_workers", [None, 1, 2])
+def test_run_subgroup_jobs_without_jobs(data, max_workers):
+    assert run_subgroup_jobs(data, {}, max_workers) == {}
@@ -0,0 +1,32 @@
+"""Tests of the coal site index."""
+import numpy as np
+import pytest
+
+from data_management.spatial import (
+    any_site_within,
+    build_site_index,
+    count_sites_within,
+    haversine_distances,
+    nearest_site_distance,
+)
+
+
+@pytest.fixture()
+def coordinates():
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(8, 35, 2_000), rng.uniform(68, 97, 2_000)
+    lat[0] = np.nan
+    site_lat, site_lon = rng.uniform(8, 35, 90), rng.uniform(68, 97, 90)
+    return lat, lon, site_lat, site_lon
+
+
+@pytest.mark.unit()
+def test_site_index_queries_match_distance_matrix(coordinates):
+    lat, lon, site_lat, site_lon = coordinates
+    index = build_site_index(site_lat, site_lon)
+    distances = haversine_distances(lat, lon, site_lat, site_lon, chunk_size=300)
+    radius = 150
+
+    np.testing.assert_allclose(nearest_site_distance(index, lat, lon), distances.min(axis=1), atol=0.005)
+    np.testing.assert_array_equal(count_sites_within(index, lat, lon, radius), (distances < radius).sum(axis=1))
+    np.testing.assert_array_equal(any_site_within(index, lat, lon, radius), (distances < radius).any(axis=1))